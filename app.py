@@ -1,43 +1,55 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import io
 import os 
-from pandas import Timedelta
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
-from openpyxl.worksheet.table import Table, TableStyleInfo
-from openpyxl.utils import get_column_letter
-import numpy as np
+import io
+import logging
+import cProfile
+import pstats
+import multiprocessing
+import re
+import weakref
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import date
+from functools import partial
 import streamlit_authenticator as stauth
-import yaml
-from yaml.loader import SafeLoader
 import copy
+from streamlit.logger import get_logger
+
 
+# Login settings (can be overridden with environment variables)
+# The re-authentication cookie is read from the request headers, so the wait streamlit-authenticator
+# does before showing the login form (0.7 s by default, on every rerun of the login screen) is not needed
+LOGIN_SLEEP_SECONDS = float(os.environ.get("HR_LOGIN_SLEEP_SECONDS", "0"))
 
-config = {
-    "credentials": {
-        "usernames": {
-            username: {
-                "name": user["name"],
-                "password": user["password"]
-            } for username, user in st.secrets["credentials"]["usernames"].items()
+# Authenticator settings read from the secrets once per server process
+@st.cache_resource
+def get_auth_config():
+    return {
+        "credentials": {
+            "usernames": {
+                username: {
+                    "name": user["name"],
+                    "password": user["password"]
+                } for username, user in st.secrets["credentials"]["usernames"].items()
+            }
+        },
+        "cookie": {
+            "name": st.secrets["cookie"]["name"],
+            "key": st.secrets["cookie"]["key"],
+            "expiry_days": int(st.secrets["cookie"]["expiry_days"])
         }
-    },
-    "cookie": {
-        "name": st.secrets["cookie"]["name"],
-        "key": st.secrets["cookie"]["key"],
-        "expiry_days": int(st.secrets["cookie"]["expiry_days"])
-    }
-}
-
-# Initialize authenticator
-authenticator = stauth.Authenticate(
-    config["credentials"],
-    config["cookie"]["name"],
-    config["cookie"]["key"],
-    config["cookie"]["expiry_days"]
-)
+    }
+
+# Initialize the authenticator once per session, with its own copy of the credentials it updates on login
+if 'authenticator' not in st.session_state:
+    config = get_auth_config()
+    st.session_state.authenticator = stauth.Authenticate(
+        copy.deepcopy(config["credentials"]),
+        config["cookie"]["name"],
+        config["cookie"]["key"],
+        config["cookie"]["expiry_days"],
+        login_sleep_time=LOGIN_SLEEP_SECONDS
+    )
+authenticator = st.session_state.authenticator
 
 # --- Perform login ---
 authenticator.login(location='main')
@@ -53,13 +65,55 @@ elif authentication_status is None:
     st.warning("Please log in to access the dashboard.")
     st.stop()
 
+# Imported once logged in, the login screen does not need the processing module
+from attendance import (
+    ANOMALY_THRESHOLD,
+    CACHE_DIR,
+    CACHE_MAX_DISK_MB,
+    CACHE_MAX_ENTRIES,
+    CHART_WEBGL_ROWS,
+    DATASET_CACHE_MAX_MB,
+    HISTORY_DB,
+    PERIOD_PATTERN,
+    PROCESSING_VERSION,
+    SESSION_IDLE_SECONDS,
+    SESSION_MEMORY_MB,
+    SESSION_SPILL_DIR,
+    STAGE_LABELS,
+    TABLE_COLUMNS,
+    TABLE_SORT_COLUMNS,
+    DatasetLoads,
+    HistoryStore,
+    IngestionCache,
+    IngestionJob,
+    LRUCache,
+    ReportJobs,
+    SessionDataManager,
+    get_report_bytes,
+    stage_history,
+    stage_logger,
+    timed_stage,
+)
+
 # User is authenticated
 authenticator.logout("Logout", "sidebar")
 st.sidebar.success(f"Welcome {name} 👋")
 
+# Admin users (usernames listed under "admins" in the secrets) see the performance panel
+is_admin = username in st.secrets.get("admins", [])
+
+# A profile left running by a rerun that ended early (st.rerun) is discarded
+if st.session_state.get("active_profiler") is not None:
+    st.session_state.active_profiler.disable()
+    st.session_state.active_profiler = None
+# Profile this rerun when an admin asked for it from the performance panel
+if is_admin and st.session_state.pop("profile_next_rerun", False):
+    st.session_state.active_profiler = cProfile.Profile()
+    st.session_state.active_profiler.enable()
 
-st.markdown("""
-<style>
+
+# Page style, sent on every rerun once logged in
+PAGE_STYLE = """
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
     
     /* Root variables for dark theme */
@@ -482,318 +536,423 @@ st.markdown("""
     .stSelectbox div[data-baseweb="select"] div[role="option"]:hover {
         background: var(--card-bg) !important;
     }
-</style>
-""", unsafe_allow_html=True)
-
-# Function to process time formats (handle strings, Timedelta, and numbers)
-def clean_time_format(value):
-    try:
-        if isinstance(value, Timedelta):
-            return value.total_seconds() / 3600.0
-        elif isinstance(value, str) and ":" in value:
-            return float(value.replace(":", "."))
-        elif pd.isna(value):
-            return 0.0
-        else:
-            return float(value)
-    except (ValueError, TypeError):
-        return 0.0
-
-# Function to process the uploaded Excel file
-def process_excel_file(file):
-    try:
-        # Read Excel file
-        df = pd.read_excel(file, sheet_name=0)
-        
-        # Clean column names
-        df.columns = [col.strip() for col in df.columns]
-        
-        # Apply time format cleaning to relevant columns (D and H)
-        if len(df.columns) >= 8:  # Ensure columns D (index 3) and H (index 7) exist
-            df.iloc[:, 3] = df.iloc[:, 3].apply(clean_time_format)  # Heures Normales
-            df.iloc[:, 7] = df.iloc[:, 7].apply(clean_time_format)  # Congé annuel
-        
-        # Initialize Presence column
-        df['Presence'] = 0.0
-        
-        # Process workers based on Jours de Présences (column L, index 11)
-        for idx, row in df.iterrows():
-            jours_presence = row.iloc[11] if len(df.columns) > 11 else None
-            if pd.isna(jours_presence) or jours_presence == '':
-                # Hourly worker: Apply formula D - ((H * 8) + 14)
-                heures_normales = float(row.iloc[3]) if pd.notna(row.iloc[3]) else 0.0
-                conge_annuel = float(row.iloc[7]) if pd.notna(row.iloc[7]) else 0.0
-                df.at[idx, 'Presence'] = heures_normales - ((conge_annuel * 8) + 14)
-            else:
-                # Daily worker: Use Jours de Présences directly
-                df.at[idx, 'Presence'] = float(jours_presence) if pd.notna(jours_presence) else 0.0
-        
-        # Convert Service en cours to string and handle NaN
-        if 'Service en cours' in df.columns:
-            df['Service en cours'] = df['Service en cours'].fillna('Unknown').astype(str)
-        
-        # Create output DataFrame with required columns
-        output_df = pd.DataFrame({
-            'Matr': df['Matricule'],
-            'Nom & Prénom': df['Nom'] + ' ' + df['Prénom'],
-            'Présence': df['Presence'],
-            'H Supp 75%': df.get('H SUP 75% Hebdomadaire 24/5-23/6', ''),
-            'Congé': df.get('Congé annuel 24/5-23/6', ''),
-            'Congé spécial': '',
-            'Feries': df.get('Nombre de jours fériés 24/5-23/6', ''),
-            'Chom Tech': df.get('Chomage technique 24/5-23/6', ''),
-            'Prime de Rendement': '',
-            'Avance sur salaire': '',
-            'Prêt /Salaire': '',
-            'Observations': 'Prime anciennete:30 dt',
-            'Service en cours': df.get('Service en cours', 'Unknown')
-        })
-        
-        return df, output_df
-    except Exception as e:
-        st.error(f"Failed to process Excel file: {str(e)}")
-        return None, None
-
-# Function to create styled Excel file
-def create_styled_excel(df, output_buffer):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Feuil1"
-    
-    # Define font
-    calibri_font = Font(name='Calibri', size=11, bold=False)
-    calibri_bold = Font(name='Calibri', size=11, bold=True)
-    
-    # Add title, subtitle, and reference line
-    ws['A1'] = "PRINCE MEDICAL INDUSTRY PMI SARL"
-    ws.merge_cells('A1:L1')
-    ws['A1'].font = calibri_bold
-    ws['A1'].alignment = Alignment(horizontal='center', vertical='center')
-    
-    ws['A2'] = "ETAT DE POINTAGE Juin 2025"
-    ws.merge_cells('A2:L2')
-    ws['A2'].font = calibri_bold
-    ws['A2'].alignment = Alignment(horizontal='center', vertical='center')
-    
-    ws['A3'] = "Présence 192 heures"
-    ws.merge_cells('A3:L3')
-    ws['A3'].font = calibri_font
-    ws['A3'].alignment = Alignment(horizontal='center', vertical='center')
-    
-    ws.append([])  # Blank row
-    
-    # Define header row
-    headers = ["Matr", "Nom & Prénom", "Présence", "H Supp 75%", "Congé", "Congé spécial",
-            "Feries", "Chom Tech", "Prime de Rendement", "Avance sur salaire", "Prêt /Salaire", "Observations"]
-    
-    # Group employees into chunks of 20
-    chunk_size = 20
-    row_idx = 5
-    table_count = 0
-    
-    for i in range(0, len(df), chunk_size):
-        # Add header
-        ws.append(headers)
-        for col in range(1, len(headers) + 1):
-            cell = ws.cell(row=row_idx, column=col)
-            cell.font = calibri_bold
-            cell.alignment = Alignment(horizontal='center')
-        
-        # Add data
-        chunk = df.iloc[i:i + chunk_size]
-        for _, row in chunk.iterrows():
-            row_idx += 1
-            ws.append([row[col] for col in headers])
-            for col in range(1, len(headers) + 1):
-                ws.cell(row=row_idx, column=col).font = calibri_font
-        
-        # Create table
-        table_ref = f"A{row_idx - len(chunk)}:L{row_idx}"
-        table = Table(displayName=f"Table{table_count}", ref=table_ref)
-        table.tableStyleInfo = TableStyleInfo(
-            name="TableStyleMedium2",
-            showFirstColumn=False,
-            showLastColumn=False,
-            showRowStripes=True,
-            showColumnStripes=False
+"""
+
+# Function to build the page style once per server process, without comments and indentation
+@st.cache_resource
+def get_page_style():
+    css = re.sub(r"/\*.*?\*/", "", PAGE_STYLE, flags=re.DOTALL)
+    return "<style>" + " ".join(line.strip() for line in css.splitlines() if line.strip()) + "</style>"
+
+st.markdown(get_page_style(), unsafe_allow_html=True)
+
+# Shared by all sessions of this server process
+@st.cache_resource
+def get_ingestion_cache():
+    return IngestionCache(CACHE_DIR, CACHE_MAX_ENTRIES, CACHE_MAX_DISK_MB * 1024 * 1024, PROCESSING_VERSION)
+
+# Ingestion pool settings (can be overridden with environment variables)
+INGESTION_WORKERS = int(os.environ.get("HR_INGESTION_WORKERS", str(os.cpu_count() or 1)))
+
+# Process pool shared by all sessions of this server process
+# Workers are forked: spawned workers would re-run this script, which Streamlit executes as __main__
+@st.cache_resource
+def get_ingestion_pool():
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return ThreadPoolExecutor(max_workers=INGESTION_WORKERS, thread_name_prefix="ingestion")
+    return ProcessPoolExecutor(max_workers=INGESTION_WORKERS, mp_context=multiprocessing.get_context("fork"))
+
+# Processed datasets shared by all sessions of this server process, see load_dataset
+@st.cache_resource
+def get_dataset_cache():
+    return LRUCache(DATASET_CACHE_MAX_MB * 1024 * 1024, sizeof=lambda shared: shared.nbytes)
+
+# Datasets being processed by the ingestion jobs of all sessions of this server process, see load_dataset
+@st.cache_resource
+def get_dataset_loads():
+    return DatasetLoads()
+
+# Latest dataset of each set of file names, a corrected re-upload is compared with it, see load_dataset
+@st.cache_resource
+def get_dataset_lineage():
+    return weakref.WeakValueDictionary()
+
+# Ingestion job settings (can be overridden with environment variables)
+INGESTION_JOBS = int(os.environ.get("HR_INGESTION_JOBS", "2"))
+
+# Threads running the ingestion jobs of all sessions of this server process, the parsing itself uses the ingestion pool
+@st.cache_resource
+def get_ingestion_executor():
+    return ThreadPoolExecutor(max_workers=INGESTION_JOBS, thread_name_prefix="ingestion-job")
+
+# Function to start processing the uploaded Excel files in the background, reusing cached results for identical uploads
+# A set of files already loaded by another session is shared as is, otherwise the workbooks that are not
+# cached yet are parsed in parallel, then all of them are merged into one dataset
+def start_ingestion(files, key):
+    workbooks = [(os.path.splitext(file.name)[0], file.getvalue()) for file in files]
+    return IngestionJob(get_ingestion_executor(), key, workbooks, get_dataset_cache(), get_session_data(),
+                        get_ingestion_cache(), get_ingestion_pool(), get_dataset_lineage(), get_dataset_loads())
+
+# Report cache settings (can be overridden with environment variables)
+REPORT_CACHE_MAX_MB = int(os.environ.get("HR_REPORT_CACHE_MAX_MB", "256"))
+
+# Shared by all sessions of this server process
+@st.cache_resource
+def get_report_cache():
+    return LRUCache(REPORT_CACHE_MAX_MB * 1024 * 1024)
+
+# Report generation settings (can be overridden with environment variables)
+REPORT_WORKERS = int(os.environ.get("HR_REPORT_WORKERS", "2"))
+
+# Worker pool shared by all sessions of this server process
+@st.cache_resource
+def get_report_executor():
+    return ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+
+# Running report jobs of all sessions of this server process, so a report is built once per dataset and format
+@st.cache_resource
+def get_report_jobs():
+    return ReportJobs(get_report_executor(), get_report_cache())
+
+# Session datasets of this server process, idle ones are spilled to disk to bound memory
+@st.cache_resource
+def get_session_data():
+    return SessionDataManager(SESSION_SPILL_DIR, SESSION_IDLE_SECONDS, SESSION_MEMORY_MB * 1024 * 1024)
+
+# History of the processed periods, shared by all sessions of this server process
+@st.cache_resource
+def get_history_store():
+    return HistoryStore(HISTORY_DB)
+
+logger = get_logger(__name__)
+
+# Stage timings are written to the server log as one JSON line per stage
+@st.cache_resource
+def configure_stage_log():
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    stage_logger.addHandler(handler)
+    stage_logger.setLevel(logging.INFO)
+    stage_logger.propagate = False
+
+configure_stage_log()
+
+# Function to render a Plotly chart, logging the size of the JSON sent to the browser
+def show_chart(name, fig):
+    with timed_stage(f"chart.{name}"):
+        logger.info("Chart '%s': %d bytes of Plotly JSON", name, len(fig.to_json()))
+        st.plotly_chart(fig)
+
+# Progress of a running report job, refreshed every half second without rerunning the page
+@st.fragment(run_every=0.5)
+def show_report_progress(job, unit="chunks"):
+    if job.done():
+        st.rerun()  # Rerun the whole page to show the download button
+    fraction = job.chunks_done / job.total_chunks if job.total_chunks else 0.0
+    st.progress(fraction, text=f"Building report: {job.chunks_done}/{job.total_chunks} {unit} written")
+
+# Function to show a report built in the background: its build button, the progress of the build or its download button
+# A build another session started for the same dataset is followed instead of started again, and the finished
+# report is read from the report cache when the download button is clicked
+def show_report(df, report_format, name, build_label, download_label, file_name, mime, unit="chunks", pool=None):
+    key = (st.session_state.dataset_key, report_format)
+    job = st.session_state.report_jobs.get(report_format)
+    if job is not None and job.key != key:
+        get_report_jobs().leave(job)  # Started for data this session no longer shows, cancelled if no one else follows it
+        job = None
+    if job is None:
+        job = st.session_state.report_jobs[report_format] = get_report_jobs().follow(*key)
+    if job is not None and not job.done():
+        show_report_progress(job, unit)
+        return
+    if job is not None and job.future.exception() is not None:
+        st.error(f"Failed to build the {name}: {job.future.exception()}")
+    if key in get_report_cache():
+        st.download_button(
+            label=download_label,
+            data=partial(get_report_bytes, get_report_cache(), st.session_state.dataset_key, df, report_format),
+            file_name=file_name,
+            mime=mime
         )
-        ws.add_table(table)
-        table_count += 1
-        
-        # Add visa lines
-        row_idx += 1
-        ws.append([])  # Blank row
-        row_idx += 1
-        ws.append(["Visa RAP"] + [""] * 8 + ["Visa Direction Général"])
-        ws.cell(row=row_idx, column=1).font = calibri_font
-        ws.cell(row=row_idx, column=10).font = calibri_font
-        row_idx += 1
-        ws.append([])  # Blank row
-        row_idx += 1
-    
-    # Adjust column widths based on data rows (starting from row 5)
-    for col_idx in range(1, len(headers) + 1):
-        column_letter = get_column_letter(col_idx)
-        max_length = 0
-        for row in range(5, ws.max_row + 1):  # Start from header row
-            cell = ws.cell(row=row, column=col_idx)
-            try:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            except:
-                pass
-        adjusted_width = max_length + 2
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    wb.save(output_buffer)
+    elif st.button(build_label):
+        st.session_state.report_jobs[report_format] = get_report_jobs().start(st.session_state.dataset_key, df,
+                                                                               report_format, pool)
+        st.rerun()
+
+# Progress of a running ingestion job, refreshed every half second without rerunning the page
+@st.fragment(run_every=0.5)
+def show_ingestion_progress(job):
+    if job.done():
+        st.rerun()  # Rerun the whole page to open Data Processing or show the error
+    st.progress(job.fraction(), text="Processing the uploaded files")
+    for source, (stage, rows) in job.workbooks.items():
+        if stage == 'queued':
+            st.caption(f"{source}: waiting")
+        elif stage == 'done':
+            st.caption(f"{source}: {rows:,} rows processed")
+        else:
+            st.caption(f"{source}: {STAGE_LABELS[stage]} ({rows:,} rows)")
+    if job.dataset_stage is not None:
+        st.caption(f"All files: {STAGE_LABELS[job.dataset_stage]}")
 
 # Streamlit app
 st.title("HR Attendance Dashboard")
 st.write("Navigate using the sidebar to view processed data or statistics.")
 
 # Initialize session state
-if 'output_df' not in st.session_state:
-    st.session_state.output_df = None
-if 'original_df' not in st.session_state:
-    st.session_state.original_df = None
+if 'dataset' not in st.session_state:
+    st.session_state.dataset = None  # Handle to the compact dataset, see get_session_data
 if 'page' not in st.session_state:
     st.session_state.page = "Upload"
+if 'read_stats' not in st.session_state:
+    st.session_state.read_stats = []
+if 'duplicates' not in st.session_state:
+    st.session_state.duplicates = None
+if 'dataset_key' not in st.session_state:
+    st.session_state.dataset_key = None
+if 'report_jobs' not in st.session_state:
+    st.session_state.report_jobs = {}  # Report job this session follows, by format
+if 'table_index' not in st.session_state:
+    st.session_state.table_index = None
+if 'stats_cube' not in st.session_state:
+    st.session_state.stats_cube = None
+if 'changes' not in st.session_state:
+    st.session_state.changes = None  # Changes from the previous upload of the same files
+if 'ingestion_job' not in st.session_state:
+    st.session_state.ingestion_job = None
+
+# Dataset of this session, reloaded from its spill file if the session was idle
+output_df = st.session_state.dataset.frame() if st.session_state.dataset is not None else None
 
 # Sidebar for navigation with buttons
 st.sidebar.header("Navigation")
-if st.session_state.page != "Upload":
+if output_df is not None:
     if st.sidebar.button("Data Processing"):
         st.session_state.page = "Data Processing"
         st.rerun()
     if st.sidebar.button("Stats"):
         st.session_state.page = "Stats"
         st.rerun()
+    if st.sidebar.button("Upload corrected files"):
+        st.session_state.dataset = None
+        st.session_state.page = "Upload"
+        st.rerun()
 else:
+    if st.session_state.page != "Upload" and st.sidebar.button("Upload"):
+        st.session_state.page = "Upload"
+        st.rerun()
     st.sidebar.write("Upload a file to enable navigation.")
+if st.sidebar.button("History"):
+    st.session_state.page = "History"
+    st.rerun()
 
 # Handle file upload and page navigation
-if st.session_state.page == "Upload" and st.session_state.output_df is None:
+if st.session_state.page == "Upload" and output_df is None:
     # Center the file uploader with wider span
     col1, col2, col3 = st.columns([1, 4, 1])
     with col2:
-        uploaded_file = st.file_uploader("Choose an Excel file", type=["xlsx"])
-    
-    if uploaded_file is not None:
-        original_df, output_df = process_excel_file(uploaded_file)
-        if output_df is not None:
-            st.session_state.original_df = original_df
-            st.session_state.output_df = output_df
+        period = st.text_input("Period (YYYY-MM)", value=f"{date.today():%Y-%m}")
+        uploaded_files = st.file_uploader("Choose Excel files (one per site)", type=["xlsx"], accept_multiple_files=True)
+    
+    job = st.session_state.ingestion_job
+    key = (tuple(file.file_id for file in uploaded_files or []), period.strip())
+    if job is not None and job.key != key:
+        job.cancel()  # Started for files or a period that are no longer selected
+        job = st.session_state.ingestion_job = None
+    
+    if uploaded_files and not PERIOD_PATTERN.match(period.strip()):
+        st.error(f"Period '{period}' is not a month in the YYYY-MM format.")
+    elif uploaded_files:
+        if job is None:
+            job = st.session_state.ingestion_job = start_ingestion(uploaded_files, key)
+        
+        if job.cancelled():
+            st.info("Processing was cancelled.")
+        elif not job.done():
+            show_ingestion_progress(job)
+            if st.button("Cancel"):
+                job.cancel()
+                st.rerun()
+        elif job.future.exception() is not None:
+            error = job.future.exception()
+            files = getattr(error, 'source', None) or "the files"
+            stage = STAGE_LABELS.get(getattr(error, 'stage', None), "Processing")
+            st.error(f"Failed to process {files}. {stage} failed: {str(error)}")
+        else:
+            shared = job.future.result()
+            st.session_state.ingestion_job = None
+            # Keep the period in the history store, unless this dataset is already saved for it
+            try:
+                dataset = shared.handle.frame()
+                with timed_stage('history.save', len(dataset)):
+                    get_history_store().save_period(period.strip(), dataset, shared.key, shared.changes)
+            except Exception as e:
+                st.error(f"Failed to save the period to the history: {str(e)}")
+            # The session only references the shared compact dataset and its precomputed Stats cube
+            st.session_state.dataset = shared.handle
+            st.session_state.dataset_key = shared.key
+            st.session_state.stats_cube = shared.stats_cube
+            st.session_state.table_index = shared.table_index
+            st.session_state.read_stats = shared.read_stats
+            st.session_state.duplicates = shared.duplicates
+            st.session_state.changes = shared.changes
             st.session_state.page = "Data Processing"
             st.rerun()  # Redirect to Data Processing page
+        
+        if job is not None and (job.done() or job.cancelled()) and st.button("Process again"):
+            st.session_state.ingestion_job = None
+            st.rerun()
 else:
     # Service filter for Stats page only
-    if st.session_state.output_df is not None:
-        try:
-            services = sorted([str(x) for x in st.session_state.output_df['Service en cours'].unique() if pd.notna(x)])
-            services = ["All Services"] + services  # Add All Services option
-        except Exception as e:
-            st.error(f"Error sorting services: {str(e)}")
-            services = []
+    if output_df is not None:
+        services = list(st.session_state.stats_cube)  # "All Services" first, then the sorted services
         
-        if st.session_state.page == "Data Processing":
-            filtered_df = st.session_state.output_df  # No filtering
+        if st.session_state.page != "Stats":
+            filtered_df = output_df  # No filtering
         else:  # Stats page
             selected_service = st.selectbox(
                 "Filter by Service", 
                 services,
                 index=0  # Default to All Services
             )
+            service_stats = st.session_state.stats_cube[selected_service]
             if selected_service == "All Services":
-                filtered_df = st.session_state.output_df
+                filtered_df = output_df
             else:
-                filtered_df = st.session_state.output_df[
-                    st.session_state.output_df['Service en cours'] == selected_service
-                ]
+                filtered_df = output_df.iloc[service_stats['positions']]
     else:
         filtered_df = None
 
     # Page logic
-    if st.session_state.page == "Data Processing" and st.session_state.output_df is not None:
+    if st.session_state.page == "Data Processing" and output_df is not None:
         # Display processed data
         st.subheader("Processed Data")
-        st.dataframe(filtered_df[['Matr', 'Nom & Prénom', 'Présence', 'H Supp 75%', 
-                                'Congé', 'Feries', 'Chom Tech', 'Observations']])
+        for read_stats in st.session_state.read_stats:
+            peak_memory = f"{read_stats['peak_memory_mb']:.0f} MB" if read_stats['peak_memory_mb'] is not None else "n/a"
+            st.caption(
+                f"{read_stats['source']}: read {read_stats['rows']:,} rows in {read_stats['seconds']:.2f} s "
+                f"({read_stats['rows_per_second'] or 0:,.0f} rows/s, engine: {read_stats['engine']}, peak memory: {peak_memory})"
+                + (", reused from the ingestion cache" if read_stats['cached'] else "")
+            )
+            if read_stats['coerced_time_cells']:
+                st.warning(f"{read_stats['source']}: {read_stats['coerced_time_cells']} time value(s) could not be read and were set to 0.")
+        cache_stats = get_dataset_cache().stats()
+        st.caption(
+            f"Shared dataset cache: {cache_stats['entries']} dataset(s), {cache_stats['bytes'] / 1024 / 1024:.1f} of "
+            f"{cache_stats['max_bytes'] / 1024 / 1024:.0f} MB, {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['evictions']} evictions"
+        )
         
-        # Download processed data
-        output = io.BytesIO()
-        create_styled_excel(filtered_df, output)
-        st.download_button(
-            label="Download Processed Data",
-            data=output.getvalue(),
-            file_name="etat_de_pointage.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        # Summary of what changed since the previous upload of the same files
+        changes = st.session_state.changes
+        if changes is not None:
+            chunks = ", ".join(str(chunk + 1) for chunk in changes['chunks'][:20])
+            if len(changes['chunks']) > 20:
+                chunks += ", ..."
+            st.info(
+                f"Compared with the previous upload of these files: {len(changes['added']):,} added, "
+                f"{len(changes['removed']):,} removed, {len(changes['changed']):,} changed and "
+                f"{changes['unchanged']:,} unchanged employee(s). "
+                f"Report tables changed: {len(changes['chunks']):,} of {changes['total_chunks']:,}"
+                + (f" ({chunks})." if chunks else ".")
+            )
+            if changes['services']:
+                st.caption(f"Statistics recomputed for: {', '.join(sorted(changes['services']))}")
+            with st.expander("Show changes"):
+                for name in ['changed', 'added', 'removed']:
+                    if not changes[name].empty:
+                        st.write(f"**{name.capitalize()} employees**")
+                        st.dataframe(changes[name])
+        
+        duplicates = st.session_state.duplicates
+        if duplicates is not None and not duplicates.empty:
+            st.warning(f"{duplicates['Matr'].nunique()} Matricule(s) appear in more than one file.")
+            with st.expander("Show duplicate Matricules"):
+                st.dataframe(duplicates)
+        
+        # Paginated table, only the visible page is sent to the browser
+        col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+        with col1:
+            query = st.text_input("Search Matricule, name or service", key="table_query")
+        with col2:
+            sort_column = st.selectbox("Sort by", ["File order"] + TABLE_SORT_COLUMNS, key="table_sort")
+        with col3:
+            page_size = st.selectbox("Rows per page", [25, 50, 100, 250], key="table_page_size")
+        with col4:
+            descending = st.toggle("Descending", key="table_descending")
+        
+        order = st.session_state.table_index.positions(
+            query, None if sort_column == "File order" else sort_column, descending
         )
-    
-    elif st.session_state.page == "Stats" and st.session_state.output_df is not None:
+        page_count = max(1, -(-len(order) // page_size))
+        if st.session_state.get("table_page", 1) > page_count:
+            st.session_state.table_page = 1  # The search left fewer pages than the one shown
+        page = st.number_input(f"Page (of {page_count:,})", min_value=1, max_value=page_count, key="table_page")
+        rows = order[(page - 1) * page_size:page * page_size]
+        st.dataframe(filtered_df.iloc[rows][TABLE_COLUMNS])
+        st.caption(f"Showing {len(rows):,} of {len(order):,} employees")
+        
+        # Styled report, built in the background when requested and cached per dataset
+        show_report(filtered_df, "xlsx", "report", "Build Report", "Download Processed Data",
+                    "etat_de_pointage.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        
+        # One styled report per service in a zip archive, built on the worker processes when requested
+        show_report(filtered_df, "zip", "reports per service", "Build Reports per Service", "Download Reports per Service",
+                    "etat_de_pointage_par_service.zip", "application/zip", "service reports", get_ingestion_pool())
+        
+        # Plain CSV and Parquet exports for other systems, streamed from the dataset when clicked and cached per dataset
+        col1, col2 = st.columns(2)
+        exports = [("csv", "Download CSV", "text/csv"), ("parquet", "Download Parquet", "application/vnd.apache.parquet")]
+        for column, (report_format, label, mime) in zip([col1, col2], exports):
+            with column:
+                st.download_button(
+                    label=label,
+                    data=partial(get_report_bytes, get_report_cache(), st.session_state.dataset_key, filtered_df, report_format),
+                    file_name=f"etat_de_pointage.{report_format}",
+                    mime=mime
+                )
+    
+    elif st.session_state.page == "Stats" and output_df is not None:
         st.subheader("Attendance Statistics")
         
         # Summary statistics
         st.write("**Summary Statistics for Presence**")
-        stats = filtered_df['Présence'].describe()
-        st.write(stats)
+        st.write(service_stats['summary'])
         
-        # Anomaly detection (using z-scores)
+        # Employees whose presence is far from the others of their service and worker type, scored once per dataset
         st.write("**Anomaly Detection**")
-        worker_type = st.session_state.original_df['Jours de Présences 24/5-23/6'].apply(
-            lambda x: 'Hourly' if pd.isna(x) or x == '' else 'Daily'
-        )
-        filtered_worker_type = worker_type[st.session_state.output_df['Service en cours'].isin(
-            [selected_service] if selected_service != "All Services" else services[1:]
-        )]
-        hourly_workers = filtered_df[filtered_worker_type == 'Hourly']
-        daily_workers = filtered_df[filtered_worker_type == 'Daily']
-        
-        # Top 5 and Worst 5 for Hourly Workers
-        if not hourly_workers.empty:
-            hourly_workers = hourly_workers.copy()
-            hourly_workers['Z-Score'] = np.abs((hourly_workers['Présence'] - hourly_workers['Présence'].mean()) / 
-                                            hourly_workers['Présence'].std())
-            st.write("**Hourly Workers**")
-            
-            # Top 5 (highest presence)
-            top_5_hourly = hourly_workers.nlargest(5, 'Présence')[['Matr', 'Nom & Prénom', 'Présence', 'Service en cours']]
-            st.write("Top 5 Hourly Workers (Highest Presence)")
-            st.dataframe(top_5_hourly)
-            
-            # Worst 5 (lowest presence)
-            worst_5_hourly = hourly_workers.nsmallest(5, 'Présence')[['Matr', 'Nom & Prénom', 'Présence', 'Service en cours']]
-            st.write("Worst 5 Hourly Workers (Lowest Presence)")
-            st.dataframe(worst_5_hourly)
+        anomalies = service_stats['anomalies']
+        if anomalies.empty:
+            st.write(f"No employee has a robust z-score above {ANOMALY_THRESHOLD:g} within their service and worker type.")
+        else:
+            st.write(f"{len(anomalies):,} employee(s) with a robust z-score (median/MAD) above {ANOMALY_THRESHOLD:g} "
+                     f"within their service and worker type")
+            st.dataframe(anomalies)
         
-        # Top 5 and Worst 5 for Daily Workers
-        if not daily_workers.empty:
-            daily_workers = daily_workers.copy()
-            daily_workers['Z-Score'] = np.abs((daily_workers['Présence'] - daily_workers['Présence'].mean()) / 
-                                            daily_workers['Présence'].std())
-            st.write("**Daily Workers**")
+        # Top 5 and Worst 5 per worker type
+        st.write("**Top and Worst Presence**")
+        for worker in ['Hourly', 'Daily']:
+            if worker not in service_stats['top_5']:
+                continue
+            st.write(f"**{worker} Workers**")
             
             # Top 5 (highest presence)
-            top_5_daily = daily_workers.nlargest(5, 'Présence')[['Matr', 'Nom & Prénom', 'Présence', 'Service en cours']]
-            st.write("Top 5 Daily Workers (Highest Presence)")
-            st.dataframe(top_5_daily)
+            st.write(f"Top 5 {worker} Workers (Highest Presence)")
+            st.dataframe(service_stats['top_5'][worker])
             
             # Worst 5 (lowest presence)
-            worst_5_daily = daily_workers.nsmallest(5, 'Présence')[['Matr', 'Nom & Prénom', 'Présence', 'Service en cours']]
-            st.write("Worst 5 Daily Workers (Lowest Presence)")
-            st.dataframe(worst_5_daily)
+            st.write(f"Worst 5 {worker} Workers (Lowest Presence)")
+            st.dataframe(service_stats['worst_5'][worker])
         
-        # Visualizations
+        # Visualizations, the chart libraries are only imported by the pages that draw charts
         st.subheader("Visualizations")
+        import numpy as np
+        import plotly.express as px
+        import plotly.graph_objects as go
         
         # Bar chart: Average Presence by Service
-        worker_type = st.session_state.original_df['Jours de Présences 24/5-23/6'].apply(
-            lambda x: 'Hourly' if pd.isna(x) or x == '' else 'Daily'
-        )
-        df_with_worker_type = filtered_df.copy()
-        df_with_worker_type['Worker Type'] = worker_type
-        avg_presence_by_service = df_with_worker_type.groupby(['Service en cours', 'Worker Type'])['Présence'].mean().reset_index()
         fig_bar = px.bar(
-            avg_presence_by_service,
+            service_stats['avg_presence'],
             x='Service en cours',
             y='Présence',
             color='Worker Type',
@@ -803,31 +962,132 @@ else:
             color_discrete_sequence=['#1f77b4', '#ff7f0e'],
             range_y=[0, 300]  # Cap y-axis at 300
         )
-        st.plotly_chart(fig_bar)
+        show_chart("Average Presence by Service", fig_bar)
         
-        # Box plot: Presence Distribution by Service
-        fig_box = px.box(
-            filtered_df,
-            x='Service en cours',
-            y='Présence',
+        # Box plot: Presence Distribution by Service, from the precomputed statistics
+        # Only the outliers are sent as points, with the employee name on hover
+        box = service_stats['box']
+        outliers = service_stats['outliers']
+        fig_box = go.Figure(go.Box(
+            x=[str(service) for service in box.index],
+            q1=box['q1'], median=box['median'], q3=box['q3'],
+            lowerfence=box['lowerfence'], upperfence=box['upperfence'],
+            name='Présence', boxpoints=False, marker_color='#636efa'
+        ))
+        scatter = go.Scattergl if len(filtered_df) > CHART_WEBGL_ROWS else go.Scatter
+        fig_box.add_trace(scatter(
+            x=outliers['Service en cours'].astype(str), y=outliers['Présence'], mode='markers',
+            hovertext=outliers['Nom & Prénom'], marker_color='#636efa', showlegend=False,
+            hovertemplate="Service=%{x}<br>Presence=%{y}<br>Nom & Prénom=%{hovertext}<extra></extra>"
+        ))
+        fig_box.update_layout(
             title="Presence Distribution by Service",
-            labels={'Présence': 'Presence (Hours/Days)', 'Service en cours': 'Service'},
-            hover_data=['Nom & Prénom'],
-            range_y=[0, 300]  # Cap y-axis at 300
+            xaxis_title='Service', yaxis_title='Presence (Hours/Days)',
+            yaxis_range=[0, 300], showlegend=False  # Cap y-axis at 300
         )
-        st.plotly_chart(fig_box)
+        show_chart("Presence Distribution by Service", fig_box)
         
-        # Histogram of Presence
+        # Histogram of Presence, from the precomputed bins
         st.write("**Presence Distribution**")
-        fig_hist = px.histogram(
-            filtered_df,
-            x='Présence',
-            color=filtered_worker_type,
+        edges, counts = service_stats['histogram']
+        fig_hist = go.Figure([
+            go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=worker_counts, width=np.diff(edges), name=worker)
+            for worker, worker_counts in counts.items()
+        ])
+        fig_hist.update_layout(
             title="Distribution of Presence (Hourly vs Daily Workers)",
-            labels={'Présence': 'Presence (Hours/Days)', 'color': 'Worker Type'},
-            nbins=20
+            xaxis_title='Presence (Hours/Days)', yaxis_title='count', legend_title_text='Worker Type',
+            barmode='stack', bargap=0
         )
-        st.plotly_chart(fig_hist)
+        show_chart("Distribution of Presence", fig_hist)
+    
+    elif st.session_state.page == "History":
+        st.subheader("Attendance History")
+        history = get_history_store()
+        periods = history.periods()
+        if periods.empty:
+            st.info("No period has been saved yet. Processed uploads are saved to the history automatically.")
+        else:
+            st.caption(f"{len(periods)} period(s) from {periods['period'].iloc[0]} to {periods['period'].iloc[-1]}")
+            
+            # Service averages by month
+            st.write("**Average Presence by Service and Month**")
+            import plotly.express as px
+            selected_services = st.multiselect("Services", history.services())
+            with timed_stage('history.service_averages') as stage:
+                averages = history.service_averages(selected_services)
+                stage['rows'] = len(averages)
+            fig_services = px.line(
+                averages,
+                x='period',
+                y='avg_presence',
+                color='service',
+                line_dash='worker_type',
+                markers=True,
+                title="Average Presence by Service (Hours/Days)",
+                labels={'avg_presence': 'Average Presence (Hours/Days)', 'period': 'Period', 'service': 'Service',
+                        'worker_type': 'Worker Type'}
+            )
+            show_chart("Average Presence by Service and Month", fig_services)
+            
+            # One employee over the stored periods
+            st.write("**Employee Presence over Time**")
+            matr = st.text_input("Matricule")
+            if matr.strip():
+                with timed_stage('history.employee') as stage:
+                    employee = history.employee_history(matr)
+                    stage['rows'] = len(employee)
+                if employee.empty:
+                    st.warning(f"No history for Matricule {matr}.")
+                else:
+                    fig_employee = px.line(
+                        employee,
+                        x='period',
+                        y='presence',
+                        markers=True,
+                        title=f"Presence of {employee['name'].iloc[-1]} ({matr})",
+                        labels={'presence': 'Presence (Hours/Days)', 'period': 'Period'}
+                    )
+                    show_chart("Employee Presence over Time", fig_employee)
+                    st.dataframe(employee, hide_index=True)
+            
+            with st.expander("Saved periods"):
+                st.dataframe(periods, hide_index=True)
     
     else:
         st.info("Please upload an Excel file to begin.")
+
+# Finish the profile of this rerun
+if st.session_state.get("active_profiler") is not None:
+    st.session_state.active_profiler.disable()
+    profile_report = io.StringIO()
+    pstats.Stats(st.session_state.active_profiler, stream=profile_report).sort_stats("cumulative").print_stats(50)
+    st.session_state.profile_report = profile_report.getvalue()
+    st.session_state.active_profiler = None
+
+# Performance panel for admins: recent stage timings of this server process and an on-demand profile
+if is_admin:
+    with st.sidebar.expander("Performance"):
+        import pandas as pd
+        timings = pd.DataFrame(list(stage_history))
+        if timings.empty:
+            st.caption("No stage has run yet.")
+        else:
+            st.write("**Stages**")
+            st.dataframe(timings.groupby('stage', sort=False).agg(
+                runs=('seconds', 'size'),
+                last_s=('seconds', 'last'),
+                mean_s=('seconds', 'mean'),
+                max_s=('seconds', 'max'),
+                last_rows=('rows', 'last'),
+                last_memory_mb=('memory_delta_mb', 'last')
+            ))
+            st.write("**Recent**")
+            st.dataframe(timings[['stage', 'rows', 'seconds', 'memory_delta_mb']].tail(20).iloc[::-1], hide_index=True)
+        
+        if st.button("Profile next rerun"):
+            st.session_state.profile_next_rerun = True
+            st.rerun()
+        if st.session_state.get("profile_report"):
+            st.download_button("Download profile", st.session_state.profile_report, file_name="rerun_profile.txt")
+            st.code("\n".join(st.session_state.profile_report.splitlines()[:40]))
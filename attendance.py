@@ -0,0 +1,1654 @@
+import hashlib
+import io
+import json
+import logging
+import operator
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import warnings
+import weakref
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import Future, as_completed, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+# openpyxl is imported by the functions that read or write workbooks, it is only needed once files are processed
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+# Function to convert a value to a float like float() does, None if it cannot be read
+def parse_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+# Function to convert values to floats, coercing unparsable ones to NaN
+# Returns the floats and the mask of the values that could not be read (missing values and 'nan' text are not)
+def to_float(values):
+    try:
+        return values.astype(float), pd.Series(False, index=values.index)
+    except (ValueError, TypeError):
+        parsed = pd.to_numeric(values, errors='coerce').astype(float)
+    
+    # pd.to_numeric rejects some text float() reads (e.g. '1_000'), those few cells are read one by one
+    retry = parsed.isna() & values.notna()
+    retried = [parse_float(value) for value in values[retry]]
+    failed = pd.Series(False, index=values.index)
+    failed[retry] = [value is None for value in retried]
+    parsed[retry] = [np.nan if value is None else value for value in retried]
+    return parsed, failed
+
+# Function to process time formats for a whole column (handle strings, Timedelta, numbers and blanks)
+# Returns the cleaned column and the number of cells that could not be parsed and were set to 0.0
+def clean_time_column(values):
+    if pd.api.types.is_timedelta64_dtype(values):
+        return (values.dt.total_seconds() / 3600.0).fillna(0.0), 0
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float).fillna(0.0), 0
+    
+    # Columns holding a single kind of value skip the per-cell type dispatch
+    inferred = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred == 'timedelta':
+        return (pd.to_timedelta(values).dt.total_seconds() / 3600.0).fillna(0.0), 0
+    if inferred == 'string':
+        text = values.where(values != '').str.replace(':', '.', regex=False)
+        parsed, failed = to_float(text)
+        return parsed.fillna(0.0), int(failed.sum())
+    if inferred in ('integer', 'floating', 'mixed-integer-float', 'empty'):
+        return to_float(values)[0].fillna(0.0), 0
+    
+    cleaned = pd.Series(0.0, index=values.index)
+    kinds = values.map(type)
+    blanks = values.isna()
+    timedeltas = values.map(lambda value: isinstance(value, timedelta)).astype(bool)  # Also matches pd.Timedelta
+    strings = (kinds == str) & ~blanks
+    others = ~(blanks | timedeltas | strings)
+    
+    # Timedelta values are converted to hours
+    cleaned[timedeltas] = pd.to_timedelta(values[timedeltas]).dt.total_seconds() / 3600.0
+    
+    # "HH:MM" strings are read as HH.MM, other strings as plain numbers
+    text = values[strings]
+    text = text.where(text != '').str.replace(':', '.', regex=False)
+    parsed_text, failed_text = to_float(text)
+    cleaned[strings] = parsed_text.fillna(0.0)
+    
+    # Anything else must be a number
+    parsed_others, failed_others = to_float(values[others])
+    cleaned[others] = parsed_others.fillna(0.0)
+    
+    coerced = int(failed_text.sum() + failed_others.sum())
+    return cleaned, coerced
+
+# Function to compute Presence for all workers at once
+def compute_presence(df):
+    presence = pd.Series(0.0, index=df.index)
+    
+    # Split workers based on Jours de Présences (column L)
+    jours_presence = df.get('Jours de Présences 24/5-23/6')
+    if jours_presence is not None:
+        hourly = jours_presence.isna() | (jours_presence == '')
+    else:
+        hourly = pd.Series(True, index=df.index)
+    
+    # Hourly workers: Apply formula D - ((H * 8) + 14)
+    heures_normales = df['Heures Normales'][hourly].astype(float).fillna(0.0)
+    conge_annuel = df['Congé annuel 24/5-23/6'][hourly].astype(float).fillna(0.0)
+    presence[hourly] = heures_normales - ((conge_annuel * 8) + 14)
+    
+    # Daily workers: Use Jours de Présences directly
+    if jours_presence is not None:
+        presence[~hourly] = jours_presence[~hourly].astype(float)
+    
+    return presence
+
+# Excel reader settings (can be overridden with environment variables)
+# "openpyxl-stream" reads rows in read-only mode and builds the DataFrame chunk by chunk,
+# "pandas" uses pd.read_excel and "calamine" uses pd.read_excel with the python-calamine engine
+EXCEL_ENGINE = os.environ.get("HR_EXCEL_ENGINE", "openpyxl-stream")
+READ_CHUNK_ROWS = int(os.environ.get("HR_READ_CHUNK_ROWS", "5000"))
+
+# Columns read from the attendance export: (header, fallback position, dtype, required)
+# Columns are found by header name, or at their usual position in the export when the header differs.
+# A dtype of None lets the reader infer it, object keeps the raw cell values.
+ATTENDANCE_SCHEMA = [
+    ('Matricule', None, None, True),
+    ('Nom', None, str, True),
+    ('Prénom', None, str, True),
+    ('Heures Normales', 3, object, True),  # Column D
+    ('Congé annuel 24/5-23/6', 7, object, True),  # Column H
+    ('Jours de Présences 24/5-23/6', 11, object, False),  # Column L
+    ('H SUP 75% Hebdomadaire 24/5-23/6', None, None, False),
+    ('Nombre de jours fériés 24/5-23/6', None, None, False),
+    ('Chomage technique 24/5-23/6', None, None, False),
+    ('Service en cours', None, str, False),
+]
+
+# Function to find the position of each schema column in a header row
+# Fails fast with a clear error when a required column is missing
+def resolve_schema(header, schema=ATTENDANCE_SCHEMA):
+    names = [str(name).strip() if name is not None else None for name in header]
+    positions = {}
+    for column, fallback, _, required in schema:
+        if column in names:
+            positions[column] = names.index(column)
+        elif fallback is not None and fallback < len(names) and fallback not in positions.values():
+            positions[column] = fallback
+        elif required:
+            raise ValueError(f"Required column '{column}' was not found in the uploaded file")
+    return positions
+
+# Function to get the peak resident memory of this process in MB
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# Function to get the current resident memory of this process in MB (None where /proc is not available)
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# Function to reset the peak resident memory of this process to its current size (Linux only)
+# Returns the current resident memory in MB, or None where the peak cannot be reset
+def reset_peak_rss_mb():
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")  # Reset VmHWM to the current resident set size
+    except OSError:
+        return None
+    return current_rss_mb()
+
+# Function to get the peak resident memory of this process in MB since the last reset_peak_rss_mb
+def peak_rss_since_reset_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+# Stage instrumentation settings (can be overridden with environment variables)
+STAGE_HISTORY_SIZE = int(os.environ.get("HR_STAGE_HISTORY_SIZE", "500"))
+
+# Recent stage records of this process, newest last, and the logger writing one JSON line per stage
+stage_history = deque(maxlen=STAGE_HISTORY_SIZE)
+stage_logger = logging.getLogger("attendance.stages")
+
+# Times a stage of the processing and records its duration, rows processed and memory delta
+# The record is logged as a JSON line and kept in records (stage_history by default); the caller can fill
+# in the rows once they are known through the yielded record
+@contextmanager
+def timed_stage(name, rows=None, records=None):
+    record = {'stage': name, 'rows': rows}
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as error:
+        record['error'] = type(error).__name__
+        if not hasattr(error, 'stage'):
+            error.stage = name  # The innermost stage that failed, shown to the user
+        raise
+    finally:
+        rss_after = current_rss_mb()
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        record['memory_delta_mb'] = round(rss_after - rss_before, 2) if rss_before is not None else None
+        record['rows'] = int(record['rows']) if record['rows'] is not None else None
+        record['time'] = time.time()
+        record['pid'] = os.getpid()
+        stage_logger.info(json.dumps(record, ensure_ascii=False))
+        (stage_history if records is None else records).append(record)
+
+# Function to apply the schema dtypes to a freshly read column
+def apply_dtype(values, dtype):
+    if dtype is str:
+        return values.astype(str).where(values.notna(), np.nan)
+    missing = values.isna()
+    if values.dtype == object and missing.any():
+        values = values.where(~missing, np.nan)
+    return values
+
+# Function to turn a chunk of worksheet rows into a typed DataFrame
+def rows_to_frame(rows, dtypes):
+    chunk = pd.DataFrame.from_records(rows, columns=list(dtypes), coerce_float=True)
+    for col, dtype in dtypes.items():
+        values = chunk[col]
+        if dtype is None:
+            # Match pd.read_excel: empty columns are float and whole numbers stored as floats become integers
+            values = values.infer_objects()
+            if values.isna().all():
+                values = values.astype(float)
+            elif values.dtype == float and values.notna().all() and (values % 1 == 0).all():
+                values = values.astype('int64')
+        chunk[col] = apply_dtype(values, dtype)
+    return chunk
+
+# Function to stream the first sheet of a workbook in read-only mode, building the schema columns in chunks
+# progress, if given, is called with the number of rows read after each chunk
+def read_excel_streaming(file, schema=ATTENDANCE_SCHEMA, chunk_rows=READ_CHUNK_ROWS, progress=None):
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        header = next(ws.iter_rows(max_row=1, values_only=True), None)
+        positions = resolve_schema(header or [], schema)
+        dtypes = {column: dtype for column, _, dtype, _ in schema if column in positions}
+        pick = operator.itemgetter(*positions.values())
+        width = max(positions.values()) + 1
+        
+        # Cells to the right of the last schema column are never materialized
+        rows = ws.iter_rows(min_row=2, max_col=width, values_only=True)
+        chunks = []
+        buffer = []
+        blank_rows = []
+        for row in rows:
+            if len(row) < width:
+                row = row + (None,) * (width - len(row))
+            row = pick(row)
+            if all(value is None for value in row):
+                # Blank rows are only kept when more data follows them
+                blank_rows.append(row)
+                continue
+            if blank_rows:
+                buffer.extend(blank_rows)
+                blank_rows = []
+            buffer.append(row)
+            if len(buffer) >= chunk_rows:
+                chunks.append(rows_to_frame(buffer, dtypes))
+                buffer = []
+                if progress is not None:
+                    progress(len(chunks) * chunk_rows)
+        if buffer or not chunks:
+            chunks.append(rows_to_frame(buffer, dtypes))
+    finally:
+        wb.close()
+    
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+# Function to read only the schema columns of the first sheet with pd.read_excel
+def read_excel_columns(file, engine=None, schema=ATTENDANCE_SCHEMA):
+    header = pd.read_excel(file, sheet_name=0, nrows=0, engine=engine).columns
+    positions = resolve_schema(header, schema)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    
+    dtypes = {header[positions[column]]: dtype for column, _, dtype, _ in schema
+              if column in positions and dtype is not None}
+    df = pd.read_excel(file, sheet_name=0, engine=engine, usecols=sorted(positions.values()), dtype=dtypes)
+    df.columns = sorted(positions, key=positions.get)
+    return df[list(positions)]
+
+# Function to read the first sheet of a workbook with the configured engine
+# Returns the DataFrame and read statistics (rows per second and peak memory) to compare engines
+# The peak memory is the highest resident memory during this read above the memory before it (Linux only, None elsewhere)
+# Only the streaming reader reports the rows read so far to progress
+def read_workbook(file, engine=EXCEL_ENGINE, progress=None):
+    rss_before = reset_peak_rss_mb()
+    start = time.perf_counter()
+    if engine == "openpyxl-stream":
+        df = read_excel_streaming(file, progress=progress)
+    elif engine == "pandas":
+        df = read_excel_columns(file)
+    elif engine == "calamine":
+        df = read_excel_columns(file, engine="calamine")
+    else:
+        raise ValueError(f"Unknown Excel engine '{engine}'")
+    seconds = time.perf_counter() - start
+    peak_rss = peak_rss_since_reset_mb() if rss_before is not None else None
+    
+    stats = {
+        'engine': engine,
+        'rows': len(df),
+        'seconds': seconds,
+        'rows_per_second': len(df) / seconds if seconds > 0 else None,
+        'peak_memory_mb': max(0.0, peak_rss - rss_before) if peak_rss is not None else None
+    }
+    return df, stats
+
+# Function to parse an attendance workbook
+# The timings of its stages are returned in read_stats['stages'], since it may run in a worker process
+# progress, if given, is called with the name of each stage as it starts and the rows read or processed
+def parse_excel_file(file, progress=None):
+    stages = []
+    if progress is None:
+        progress = lambda stage, rows: None
+    
+    # Read the schema columns of the Excel file
+    progress('parse.read', 0)
+    with timed_stage('parse.read', records=stages) as stage:
+        df, read_stats = read_workbook(file, progress=lambda rows: progress('parse.read', rows))
+        stage['rows'] = len(df)
+    
+    # Apply time format cleaning to relevant columns (D and H)
+    progress('parse.clean_times', len(df))
+    with timed_stage('parse.clean_times', len(df), stages):
+        heures_normales, coerced_d = clean_time_column(df['Heures Normales'])
+        conge_annuel, coerced_h = clean_time_column(df['Congé annuel 24/5-23/6'])
+        df['Heures Normales'] = heures_normales
+        df['Congé annuel 24/5-23/6'] = conge_annuel
+        read_stats['coerced_time_cells'] = coerced_d + coerced_h
+    
+    # Compute Presence column
+    progress('parse.presence', len(df))
+    with timed_stage('parse.presence', len(df), stages):
+        df['Presence'] = compute_presence(df)
+    
+    progress('parse.output_df', len(df))
+    with timed_stage('parse.output_df', len(df), stages):
+        output_df = build_output_frame(df)
+    read_stats['stages'] = stages
+    return df, output_df, read_stats
+
+# Function to build the output DataFrame of the report from the parsed workbook
+def build_output_frame(df):
+    # Convert Service en cours to string and handle NaN
+    if 'Service en cours' in df.columns:
+        df['Service en cours'] = df['Service en cours'].fillna('Unknown').astype(str)
+    
+    # Create output DataFrame with required columns
+    return pd.DataFrame({
+        'Matr': df['Matricule'],
+        'Nom & Prénom': df['Nom'] + ' ' + df['Prénom'],
+        'Présence': df['Presence'],
+        'H Supp 75%': df.get('H SUP 75% Hebdomadaire 24/5-23/6', ''),
+        'Congé': df.get('Congé annuel 24/5-23/6', ''),
+        'Congé spécial': '',
+        'Feries': df.get('Nombre de jours fériés 24/5-23/6', ''),
+        'Chom Tech': df.get('Chomage technique 24/5-23/6', ''),
+        'Prime de Rendement': '',
+        'Avance sur salaire': '',
+        'Prêt /Salaire': '',
+        'Observations': 'Prime anciennete:30 dt',
+        'Service en cours': df.get('Service en cours', 'Unknown')
+    })
+
+# Function to parse a workbook from its raw bytes, used by the ingestion process pool
+def parse_workbook_bytes(data, progress=None):
+    return parse_excel_file(io.BytesIO(data), progress)
+
+# Function to merge the datasets of several workbooks, tagging each row with its source file
+# Returns the merged frames and the rows whose Matricule appears in more than one file
+def merge_workbooks(results):
+    original_df = pd.concat([df.assign(Source=source) for source, df, _ in results], ignore_index=True)
+    output_df = pd.concat([df.assign(Source=source) for source, _, df in results], ignore_index=True)
+    
+    sources_per_matricule = output_df.groupby('Matr')['Source'].transform('nunique')
+    duplicates = output_df.loc[sources_per_matricule > 1, ['Matr', 'Nom & Prénom', 'Service en cours', 'Source']]
+    return original_df, output_df, duplicates.sort_values(['Matr', 'Source'])
+
+# Function to process several workbooks given as (source, bytes) pairs into one dataset
+# Cached results are reused, the other workbooks are parsed on the executor (inline when there is only one)
+# Returns the merged frames, the duplicated Matricules and the read stats of every workbook ('cached' when it was not parsed)
+# progress, if given, is called with the source (None for the merged dataset), the stage and the rows; the stages of
+# a workbook are reported as they run when it is parsed inline, and when it is done for one parsed on the executor
+# Errors carry the stage (see timed_stage) and the source of the workbook that failed
+def process_workbooks(workbooks, cache=None, executor=None, progress=None):
+    if progress is None:
+        progress = lambda source, stage, rows: None
+    results = []
+    pending = []
+    for source, data in workbooks:
+        key = cache.key_for(data) if cache is not None else None
+        cached = cache.get(key) if cache is not None else None
+        if cached is None:
+            pending.append((len(results), key, data))
+            cached = (None, None, None)
+        else:
+            progress(source, 'done', len(cached[1]))
+        results.append([source, *cached])
+    
+    parsed = []
+    inline = executor is None or len(pending) == 1
+    futures = [] if inline else [executor.submit(parse_workbook_bytes, data) for _, _, data in pending]
+    for future, (position, _, _) in zip(futures, pending):
+        progress(results[position][0], 'parse.read', 0)
+    for index, (position, key, data) in enumerate(pending):
+        source = results[position][0]
+        try:
+            if inline:
+                parsed.append(parse_workbook_bytes(data, lambda stage, rows: progress(source, stage, rows)))
+            else:
+                parsed.append(futures[index].result())
+        except Exception as error:
+            error.source = source
+            for future in futures:
+                future.cancel()
+            raise
+        progress(source, 'done', len(parsed[-1][1]))
+    
+    for (position, key, _), (df, output_df, stats) in zip(pending, parsed):
+        if cache is not None:
+            cache.put(key, df, output_df, stats)
+        results[position][1:] = [df, output_df, dict(stats, cached=False)]
+        # Recorded in the worker process that parsed the workbook
+        stage_history.extend(dict(record, source=results[position][0]) for record in stats['stages'])
+    
+    # Cached workbooks report the stats of the read that filled the cache
+    read_stats = [dict({'cached': True}, **stats, source=source) for source, _, _, stats in results]
+    progress(None, 'ingest.merge', sum(len(result[2]) for result in results))
+    with timed_stage('ingest.merge') as stage:
+        original_df, output_df, duplicates = merge_workbooks([result[:3] for result in results])
+        stage['rows'] = len(output_df)
+    return original_df, output_df, duplicates, read_stats
+
+# Ingestion cache settings (can be overridden with environment variables)
+PROCESSING_VERSION = "4"  # Bump whenever the processing logic changes to invalidate cached results
+CACHE_DIR = os.environ.get("HR_CACHE_DIR", os.path.join(".cache", "ingestion"))
+CACHE_MAX_ENTRIES = int(os.environ.get("HR_CACHE_MAX_ENTRIES", "8"))
+CACHE_MAX_DISK_MB = int(os.environ.get("HR_CACHE_MAX_DISK_MB", "512"))
+
+# Cache of processed workbooks keyed by a hash of the uploaded bytes.
+# The most recent results are kept in memory, all of them on disk as Parquet files with their read stats as JSON.
+class IngestionCache:
+    def __init__(self, cache_dir, max_entries, max_disk_bytes, version):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.version = version
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._remove_stale_files()
+    
+    def key_for(self, data):
+        return f"v{self.version}-{hashlib.sha256(data).hexdigest()}"
+    
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        
+        paths = self._paths(key)
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        try:
+            frames = tuple(pd.read_parquet(path) for path in paths[:2])
+            with open(paths[2]) as stats_file:
+                entry = (*frames, json.load(stats_file))
+            for path in paths:
+                os.utime(path)  # Mark as recently used for disk eviction
+        except (OSError, ValueError):
+            return None
+        self._remember(key, entry)
+        return entry
+    
+    def put(self, key, original_df, output_df, read_stats):
+        entry = (original_df, output_df, read_stats)
+        self._remember(key, entry)
+        
+        paths = self._paths(key)
+        try:
+            for frame, path in zip(entry[:2], paths):
+                frame.to_parquet(f"{path}.tmp")
+                os.replace(f"{path}.tmp", path)
+            with open(f"{paths[2]}.tmp", "w") as stats_file:
+                json.dump(read_stats, stats_file)
+            os.replace(f"{paths[2]}.tmp", paths[2])
+        except (OSError, ValueError, TypeError, NotImplementedError):
+            # Columns with mixed value types cannot be stored as Parquet, keep this entry in memory only
+            for path in paths:
+                for leftover in (path, f"{path}.tmp"):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+            return
+        self._evict_disk()
+    
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for name in os.listdir(self.cache_dir):
+            os.remove(os.path.join(self.cache_dir, name))
+    
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, f"{key}.original.parquet"),
+                os.path.join(self.cache_dir, f"{key}.output.parquet"),
+                os.path.join(self.cache_dir, f"{key}.stats.json"))
+    
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+    
+    def _evict_disk(self):
+        # Drop the least recently used entries until the cache fits in its disk budget
+        # Other jobs write and evict files concurrently, so a file may be gone by the time it is read or removed
+        entries = {}
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            key = name.split('.', 1)[0]
+            size, mtime = entries.get(key, (0, 0))
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+        
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_disk_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+    
+    def _remove_stale_files(self):
+        # Results written by another processing version are never valid again
+        for name in os.listdir(self.cache_dir):
+            if not name.startswith(f"v{self.version}-"):
+                os.remove(os.path.join(self.cache_dir, name))
+
+# Layout of the styled Excel report
+REPORT_HEADERS = ["Matr", "Nom & Prénom", "Présence", "H Supp 75%", "Congé", "Congé spécial",
+                  "Feries", "Chom Tech", "Prime de Rendement", "Avance sur salaire", "Prêt /Salaire", "Observations"]
+REPORT_VISA_LINE = ["Visa RAP"] + [""] * 8 + ["Visa Direction Général"]
+REPORT_CHUNK_SIZE = 20
+
+# Function to compute the report column widths from the DataFrame instead of reading the sheet back
+def report_column_widths(df):
+    widths = []
+    for col_idx, col in enumerate(REPORT_HEADERS):
+        max_length = 0
+        if len(df):  # Headers and visa lines are only written when there is data
+            values = df[col]
+            values = values[values.notna()]
+            values = values[(values.astype(str) != '') & (values != 0)]  # Empty cells (NA, '', 0) are ignored
+            max_length = max(len(col), len(REPORT_VISA_LINE[col_idx]) if col_idx < len(REPORT_VISA_LINE) else 0)
+            if len(values):
+                max_length = max(max_length, int(values.map(str).str.len().max()))
+        widths.append(max_length + 2)
+    return widths
+
+# Function to create a write-only cell with a named style
+def styled_cell(ws, value, style):
+    from openpyxl.cell import WriteOnlyCell
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+# Function to create styled Excel file, streaming rows through a write-only workbook
+# progress, if given, is called with (chunks written, total chunks) after each chunk
+def create_styled_excel(df, output_buffer, progress=None):
+    from openpyxl import Workbook
+    from openpyxl.styles import Alignment, Font, NamedStyle
+    from openpyxl.utils import get_column_letter
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Feuil1")
+    
+    # Define shared named styles (data cells use the default Calibri 11 font)
+    calibri_font = Font(name='Calibri', size=11, bold=False)
+    calibri_bold = Font(name='Calibri', size=11, bold=True)
+    centered = Alignment(horizontal='center', vertical='center')
+    wb.add_named_style(NamedStyle(name="Report Title", font=calibri_bold, alignment=centered))
+    wb.add_named_style(NamedStyle(name="Report Subtitle", font=calibri_font, alignment=centered))
+    wb.add_named_style(NamedStyle(name="Report Header", font=calibri_bold, alignment=Alignment(horizontal='center')))
+    
+    # Column widths must be set before any row is written
+    with timed_stage('export.column_widths', len(df)):
+        widths = report_column_widths(df)
+    for col_idx, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = width
+    
+    # Add title, subtitle, and reference line
+    ws.append([styled_cell(ws, "PRINCE MEDICAL INDUSTRY PMI SARL", "Report Title")])
+    ws.merged_cells.add('A1:L1')
+    ws.append([styled_cell(ws, "ETAT DE POINTAGE Juin 2025", "Report Title")])
+    ws.merged_cells.add('A2:L2')
+    ws.append([styled_cell(ws, "Présence 192 heures", "Report Subtitle")])
+    ws.merged_cells.add('A3:L3')
+    
+    ws.append([])  # Blank row
+    
+    # Missing names of a compacted dataset are pd.NA, which openpyxl cannot write, they are left blank
+    report_df = df[REPORT_HEADERS]
+    for column in report_df.columns:
+        if isinstance(report_df[column].dtype, pd.StringDtype):
+            report_df[column] = report_df[column].astype(object).where(report_df[column].notna(), None)
+    
+    with timed_stage('export.rows', len(df)):
+        write_report_tables(ws, report_df, progress)
+    with timed_stage('export.save', len(df)):
+        wb.save(output_buffer)
+
+# Function to write the employees in tables of 20, each followed by the visa lines
+def write_report_tables(ws, report_df, progress=None):
+    from openpyxl.worksheet.table import Table, TableStyleInfo
+    row_idx = 5
+    table_count = 0
+    total_chunks = -(-len(report_df) // REPORT_CHUNK_SIZE)
+    
+    for i in range(0, len(report_df), REPORT_CHUNK_SIZE):
+        # Add header
+        ws.append([styled_cell(ws, header, "Report Header") for header in REPORT_HEADERS])
+        
+        # Add data
+        chunk = report_df.iloc[i:i + REPORT_CHUNK_SIZE]
+        for row in chunk.itertuples(index=False, name=None):
+            ws.append(row)
+        row_idx += len(chunk)
+        
+        # Create table
+        table_ref = f"A{row_idx - len(chunk)}:L{row_idx}"
+        table = Table(displayName=f"Table{table_count}", ref=table_ref)
+        table.tableStyleInfo = TableStyleInfo(
+            name="TableStyleMedium2",
+            showFirstColumn=False,
+            showLastColumn=False,
+            showRowStripes=True,
+            showColumnStripes=False
+        )
+        # Write-only sheets cannot read the header cells back, so name the table columns here
+        table._initialise_columns()
+        for column, header in zip(table.tableColumns, REPORT_HEADERS):
+            column.name = header
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="In write-only mode you must add table columns manually")
+            ws.add_table(table)
+        table_count += 1
+        
+        # Add visa lines
+        ws.append([])  # Blank row
+        ws.append(REPORT_VISA_LINE)
+        ws.append([])  # Blank row
+        row_idx += 4
+        
+        if progress is not None:
+            progress(table_count, total_chunks)
+
+# Least recently used cache with a memory budget in bytes, safe to share between sessions
+class LRUCache:
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+    
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+    
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return  # Larger than the whole budget, never cached
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+    
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+# Function to fingerprint a dataset, used to cache results derived from it
+def dataset_fingerprint(df):
+    digest = hashlib.sha256(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    digest.update(repr(list(df.columns)).encode())
+    return digest.hexdigest()
+
+# Data export settings (can be overridden with environment variables)
+EXPORT_CHUNK_ROWS = int(os.environ.get("HR_EXPORT_CHUNK_ROWS", "50000"))  # Rows converted at a time, one Parquet row group each
+EXPORT_COLUMNS = REPORT_HEADERS + ['Service en cours', 'Worker Type', 'Source']
+
+# Function to stream the processed data to a CSV file (UTF-8, one header line), chunk by chunk
+def write_csv_report(df, output, progress=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    columns = [column for column in EXPORT_COLUMNS if column in df.columns]
+    output.write(pd.DataFrame(columns=columns).to_csv(index=False).encode('utf-8'))
+    total_chunks = -(-len(df) // chunk_rows)
+    for chunk_idx, start in enumerate(range(0, len(df), chunk_rows)):
+        output.write(df.iloc[start:start + chunk_rows][columns].to_csv(index=False, header=False).encode('utf-8'))
+        if progress is not None:
+            progress(chunk_idx + 1, total_chunks)
+
+# Function to stream the processed data to a zstd-compressed Parquet file, one row group per chunk
+# Text columns without a single type (empty strings next to numbers) are written as text
+def write_parquet_report(df, output, progress=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    columns = [column for column in EXPORT_COLUMNS if column in df.columns]
+    mixed = [column for column in columns
+             if df[column].dtype == object and pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed')]
+    frame = df[columns].assign(**{column: apply_dtype(df[column], str) for column in mixed})
+    schema = pa.Schema.from_pandas(frame.iloc[:0], preserve_index=False)
+    total_chunks = -(-len(df) // chunk_rows)
+    with pq.ParquetWriter(output, schema, compression='zstd') as writer:
+        for chunk_idx, start in enumerate(range(0, len(df), chunk_rows)):
+            chunk = pa.Table.from_pandas(frame.iloc[start:start + chunk_rows], schema=schema, preserve_index=False)
+            writer.write_table(chunk, row_group_size=chunk_rows)
+            if progress is not None:
+                progress(chunk_idx + 1, total_chunks)
+
+# Writers of each export format, called as writer(df, output, progress=None)
+REPORT_WRITERS = {"xlsx": create_styled_excel, "csv": write_csv_report, "parquet": write_parquet_report}
+
+# Function to build the styled report of one service, run on the worker pool
+def service_report_bytes(df):
+    output = io.BytesIO()
+    create_styled_excel(df, output)
+    return output.getvalue()
+
+# Function to build one styled report per 'Service en cours' and stream them into a zip archive
+# The reports are built in parallel on the executor (a process pool scales with the cores) and each one is added
+# to the archive as soon as it is done; progress is called with the reports done and the number of services
+def write_service_reports(df, output, executor=None, progress=None):
+    reports = []
+    names = set()
+    for service, rows in df.groupby('Service en cours', observed=True):
+        name = re.sub(r"[^\w\- ]", "_", str(service)).strip() or "Service"
+        while name in names:
+            name += "_"
+        names.add(name)
+        reports.append((f"{name}_etat_de_pointage.xlsx", rows))
+    
+    futures = {}
+    if executor is None:
+        done = ((name, service_report_bytes(rows)) for name, rows in reports)
+    else:
+        futures = {executor.submit(service_report_bytes, rows): name for name, rows in reports}
+        done = ((futures[future], future.result()) for future in as_completed(futures))
+    
+    # The workbooks are already compressed, so they are stored as is
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as archive:
+        try:
+            for reports_done, (name, data) in enumerate(done, start=1):
+                archive.writestr(name, data)
+                if progress is not None:
+                    progress(reports_done, len(reports))
+        finally:
+            for future in futures:
+                future.cancel()  # Only the ones not started yet, when the job was cancelled or a report failed
+
+# Function to get the report bytes for a dataset and export options, building them only once
+# The "zip" format holds one styled report per service, built on the executor when one is given
+def get_report_bytes(cache, dataset_key, df, report_format="xlsx", progress=None, executor=None):
+    key = (dataset_key, report_format)
+    data = cache.get(key)
+    if data is None:
+        output = io.BytesIO()
+        if report_format == "zip":
+            write_service_reports(df, output, executor, progress)
+        else:
+            REPORT_WRITERS[report_format](df, output, progress=progress)
+        data = output.getvalue()
+        cache.put(key, data)
+    return data
+
+class JobCancelled(Exception):
+    pass
+
+# Report built in the background on the worker pool, with progress and cancellation
+# For the "zip" format the chunks are the per-service reports, built on the pool
+class ReportJob:
+    def __init__(self, executor, cache, dataset_key, df, report_format="xlsx", pool=None):
+        self.key = (dataset_key, report_format)
+        self.chunks_done = 0
+        if report_format == "zip":
+            self.total_chunks = df['Service en cours'].nunique()  # One report per service, see write_service_reports
+        else:
+            self.total_chunks = -(-len(df) // REPORT_CHUNK_SIZE)
+        self._cancelled = threading.Event()
+        self.future = executor.submit(get_report_bytes, cache, dataset_key, df, report_format, self._progress, pool)
+    
+    def _progress(self, chunks_done, total_chunks):
+        if self._cancelled.is_set():
+            raise JobCancelled()
+        self.chunks_done = chunks_done
+        self.total_chunks = total_chunks
+    
+    def cancel(self):
+        self._cancelled.set()
+        self.future.cancel()
+    
+    def done(self):
+        return self.future.done()
+
+# Report jobs of all sessions keyed by (dataset key, format), so sessions asking for the same report share one build
+# Only running jobs are kept, a finished report is read from the report cache. Each session following a job counts,
+# and the job is cancelled when the last one leaves it for other data
+class ReportJobs:
+    def __init__(self, executor, cache):
+        self.executor = executor
+        self.cache = cache
+        self._jobs = {}
+        self._followers = {}
+        self._lock = threading.Lock()
+    
+    def _prune(self):
+        for key in [key for key, job in self._jobs.items() if job.done()]:
+            del self._jobs[key]
+            del self._followers[key]
+    
+    def follow(self, dataset_key, report_format):
+        with self._lock:
+            self._prune()
+            job = self._jobs.get((dataset_key, report_format))
+            if job is not None:
+                self._followers[job.key] += 1
+            return job
+    
+    def start(self, dataset_key, df, report_format="xlsx", pool=None):
+        with self._lock:
+            self._prune()
+            job = self._jobs.get((dataset_key, report_format))
+            if job is None:
+                job = ReportJob(self.executor, self.cache, dataset_key, df, report_format, pool)
+                self._jobs[job.key] = job
+                self._followers[job.key] = 0
+            self._followers[job.key] += 1
+            return job
+    
+    def leave(self, job):
+        with self._lock:
+            if self._jobs.get(job.key) is not job:
+                return  # Already finished or cancelled
+            self._followers[job.key] -= 1
+            if self._followers[job.key] <= 0:
+                del self._jobs[job.key]
+                del self._followers[job.key]
+                job.cancel()
+
+# Stages reported by an ingestion job, for each workbook and then for the merged dataset
+INGESTION_STAGES = ['parse.read', 'parse.clean_times', 'parse.presence', 'parse.output_df']
+DATASET_STAGES = ['ingest.merge', 'ingest.compact', 'stats.cube']
+STAGE_LABELS = {
+    'parse.read': "Reading the workbook", 'parse.clean_times': "Cleaning the time columns",
+    'parse.presence': "Computing Presence", 'parse.output_df': "Building the output table",
+    'ingest.merge': "Merging the workbooks", 'ingest.compact': "Compacting the dataset",
+    'ingest.diff': "Comparing with the previous upload", 'stats.cube': "Computing the statistics",
+    'ingest.shared': "Waiting for another session processing the same files",
+    'stats.table_index': "Indexing the table"
+}
+
+# Uploaded workbooks processed in the background on the worker pool, see load_dataset
+# The stage and rows of each workbook are kept for the progress display; cancelling stops the job at the next
+# reported step (each chunk of rows read when a single workbook is parsed)
+class IngestionJob:
+    def __init__(self, executor, key, workbooks, *args):
+        self.key = key
+        self.workbooks = {source: ('queued', 0) for source, _ in workbooks}
+        self.dataset_stage = None
+        self._cancelled = threading.Event()
+        self.future = executor.submit(load_dataset, workbooks, *args, progress=self._progress)
+    
+    def _progress(self, source, stage, rows):
+        if self._cancelled.is_set():
+            raise JobCancelled()
+        if source is None:
+            self.dataset_stage = stage
+        else:
+            self.workbooks[source] = (stage, rows)
+    
+    # Fraction of the stages done, each workbook and the merged dataset weighing their number of stages
+    def fraction(self):
+        done = 0
+        for stage, _ in self.workbooks.values():
+            if stage == 'done':
+                done += len(INGESTION_STAGES)
+            elif stage in INGESTION_STAGES:
+                done += INGESTION_STAGES.index(stage)
+        if self.dataset_stage in DATASET_STAGES:
+            done += DATASET_STAGES.index(self.dataset_stage)
+        return done / (len(INGESTION_STAGES) * len(self.workbooks) + len(DATASET_STAGES))
+    
+    def cancel(self):
+        self._cancelled.set()
+        self.future.cancel()
+    
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    def done(self):
+        return self.future.done()
+
+# Columns shown in the Stats top/worst tables
+STATS_COLUMNS = ['Matr', 'Nom & Prénom', 'Présence', 'Service en cours']
+
+# Function to get the worker type of each employee: hourly when Jours de Présences is empty, daily otherwise
+def worker_types(original_df):
+    jours_presence = original_df.get('Jours de Présences 24/5-23/6')
+    if jours_presence is None:
+        return pd.Series('Hourly', index=original_df.index)
+    hourly = jours_presence.isna() | (jours_presence == '')
+    return pd.Series(np.where(hourly, 'Hourly', 'Daily'), index=original_df.index)
+
+# Columns of the session dataset that stay plain strings, every other text column is stored as a categorical
+SESSION_STRING_COLUMNS = ['Nom & Prénom']
+
+# Function to downcast a numeric column without changing any of its values
+def downcast_numeric(values):
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast='integer')
+    if pd.api.types.is_float_dtype(values):
+        float32 = values.astype('float32')
+        if (float32.astype(values.dtype) == values).sum() == values.notna().sum():
+            return float32
+    return values
+
+# Function to build the compact dataset kept in the session: the output columns plus the worker type
+# Services, sources, worker types and the constant report columns become categoricals and numbers are
+# downcast where no value changes, the raw columns of the original workbook are not kept
+def compact_dataset(original_df, output_df):
+    dataset = output_df.assign(**{'Worker Type': worker_types(original_df).to_numpy()})
+    for column in dataset.columns:
+        values = dataset[column]
+        if pd.api.types.is_numeric_dtype(values):
+            dataset[column] = downcast_numeric(values)
+        elif column in SESSION_STRING_COLUMNS:
+            dataset[column] = values.astype(pd.StringDtype("pyarrow"))
+        else:
+            dataset[column] = values.astype('category')
+    return dataset
+
+# Chart data settings (can be overridden with environment variables)
+CHART_WEBGL_ROWS = int(os.environ.get("HR_CHART_WEBGL_ROWS", "5000"))  # Point traces use WebGL above this many rows
+HISTOGRAM_BINS = 20
+
+# Function to compute the box plot statistics of each service, the same ones Plotly derives from the raw points
+# Returns one row per service (q1, median, q3 and the whiskers, which end at the furthest point within
+# 1.5 IQR of the box) and the outlier points beyond the whiskers, the only ones sent to the browser
+def box_statistics(data):
+    presence = data['Présence']
+    grouped = presence.groupby(data['Service en cours'])
+    q1 = grouped.transform('quantile', 0.25)
+    q3 = grouped.transform('quantile', 0.75)
+    inside = presence.between(q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1))
+    
+    whiskers = presence[inside].groupby(data['Service en cours'][inside]).agg(['min', 'max'])
+    box = pd.DataFrame({
+        'q1': grouped.quantile(0.25),
+        'median': grouped.median(),
+        'q3': grouped.quantile(0.75),
+        'lowerfence': whiskers['min'],
+        'upperfence': whiskers['max']
+    }).dropna(subset=['median'])
+    outliers = data.loc[presence.notna() & ~inside, ['Service en cours', 'Présence', 'Nom & Prénom']]
+    return box, outliers
+
+# Function to bin the presence of each worker type on shared edges, like a histogram colored by worker type
+def histogram_bins(data, bins=HISTOGRAM_BINS):
+    presence = data['Présence'].dropna()
+    edges = np.histogram_bin_edges(presence, bins=bins) if len(presence) else np.array([0.0, 1.0])
+    counts = {worker: np.histogram(values, bins=edges)[0]
+              for worker, values in presence.groupby(data['Worker Type'].loc[presence.index])}
+    return edges, counts
+
+# Anomaly detection settings (can be overridden with environment variables)
+ANOMALY_THRESHOLD = float(os.environ.get("HR_ANOMALY_THRESHOLD", "3.5"))  # Robust z-score above which presence is flagged
+ANOMALY_COLUMNS = ['Matr', 'Nom & Prénom', 'Service en cours', 'Worker Type', 'Présence', 'Z-Score', 'Robust Z-Score']
+
+# Function to score the presence of every employee against the others of the same service and worker type
+# The z-score uses the mean and standard deviation of the group, the robust z-score its median and MAD
+# (0.6745 * (x - median) / MAD, or the mean absolute deviation when over half of the group has the median),
+# which a few extreme values cannot shift, so small services are not hidden by their own outliers
+# Returns the employees whose robust z-score exceeds the threshold, the furthest first
+def anomaly_scores(data, threshold=ANOMALY_THRESHOLD):
+    presence = data['Présence'].astype(float)
+    groups = [data['Service en cours'], data['Worker Type']]
+    grouped = presence.groupby(groups, observed=True)
+    median = grouped.transform('median')
+    deviation = (presence - median).abs()
+    deviations = deviation.groupby(groups, observed=True)
+    mad = deviations.transform('median')
+    scale = (mad / 0.6745).where(mad > 0, 1.253314 * deviations.transform('mean'))
+    
+    scores = data.assign(**{
+        'Z-Score': ((presence - grouped.transform('mean')) / grouped.transform('std')).round(2),
+        'Robust Z-Score': ((presence - median) / scale).round(2)
+    })
+    flagged = scores[scores['Robust Z-Score'].abs() > threshold]
+    return flagged[ANOMALY_COLUMNS].sort_values('Robust Z-Score', key=abs, ascending=False, kind='stable')
+
+# Function to precompute the Stats page for every service filter, including "All Services"
+# Each entry holds the row positions of the service, its summary statistics, the top/worst 5 per worker type,
+# the mean presence per service and worker type, the chart data and the anomalies, so switching the filter is
+# a dictionary lookup
+# Rows are identified by their index, so a cube can also be built for some rows of a dataset indexed by position
+def build_stats_cube(dataset):
+    data = dataset[STATS_COLUMNS + ['Worker Type']]
+    labels = data.index.to_numpy()
+    
+    # One grouped pass for all services and worker types
+    summaries = data.groupby('Service en cours')['Présence'].describe()
+    box, outliers = box_statistics(data)
+    avg_presence = data.groupby(['Service en cours', 'Worker Type'])['Présence'].mean().reset_index()
+    anomalies = anomaly_scores(data)
+    ranked = data.dropna(subset=['Présence'])
+    highest = ranked.sort_values('Présence', ascending=False, kind='stable')
+    lowest = ranked.sort_values('Présence', kind='stable')
+    
+    def first_5(ordered, by):
+        return {worker: group[STATS_COLUMNS] for worker, group in ordered.groupby(by).head(5).groupby('Worker Type')}
+    
+    cube = {"All Services": {
+        'positions': labels,
+        'summary': data['Présence'].describe(),
+        'top_5': first_5(highest, 'Worker Type'),
+        'worst_5': first_5(lowest, 'Worker Type'),
+        'avg_presence': avg_presence,
+        'box': box,
+        'outliers': outliers,
+        'histogram': histogram_bins(data),
+        'anomalies': anomalies
+    }}
+    top_5 = highest.groupby(['Service en cours', 'Worker Type']).head(5)
+    worst_5 = lowest.groupby(['Service en cours', 'Worker Type']).head(5)
+    for service, positions in data.groupby('Service en cours').indices.items():
+        cube[str(service)] = {
+            'positions': labels[positions],
+            'summary': summaries.loc[service].rename('Présence'),
+            'top_5': first_5(top_5[top_5['Service en cours'] == service], 'Worker Type'),
+            'worst_5': first_5(worst_5[worst_5['Service en cours'] == service], 'Worker Type'),
+            'avg_presence': avg_presence[avg_presence['Service en cours'] == service].reset_index(drop=True),
+            'box': box.loc[[service]] if service in box.index else box.iloc[:0],
+            'outliers': outliers[outliers['Service en cours'] == service],
+            'histogram': histogram_bins(data.iloc[positions]),
+            'anomalies': anomalies[anomalies['Service en cours'] == service]
+        }
+    return cube
+
+# Function to update the stats cube of the previous version of a dataset after some rows were added, removed or changed
+# Only the given services, and those whose rows moved, are recomputed; the "All Services" entry is assembled from the
+# service entries, apart from its summary and histogram which are single vectorized passes
+def update_stats_cube(cube, dataset, services):
+    data = dataset[STATS_COLUMNS + ['Worker Type']]
+    # Entries of a version whose numbers were downcast to other widths (e.g. a larger Matricule) are not reused
+    reused = cube["All Services"]['anomalies']
+    if any(reused[column].dtype != data[column].dtype for column in ['Matr', 'Présence']):
+        return build_stats_cube(dataset)
+    indices = data.groupby('Service en cours').indices
+    stale = [service for service, positions in indices.items()
+             if str(service) in services or str(service) not in cube
+             or not np.array_equal(cube[str(service)]['positions'], positions)]
+    if len(stale) == len(indices):
+        return build_stats_cube(dataset)
+    rebuilt = {}
+    if stale:
+        positions = np.sort(np.concatenate([indices[service] for service in stale]))
+        rebuilt = build_stats_cube(data.iloc[positions].set_axis(positions))
+    entries = [rebuilt[str(service)] if service in stale else cube[str(service)] for service in indices]
+    
+    # Reused entries keep the categories of the previous version
+    dtypes = {'Service en cours': data['Service en cours'].dtype, 'Worker Type': data['Worker Type'].dtype}
+    def combine(frames):
+        combined = pd.concat(frames)
+        return combined.astype({column: dtype for column, dtype in dtypes.items() if column in combined.columns})
+    
+    def first_5(name, ascending):
+        ranked = {}
+        for worker in data['Worker Type'].cat.categories:
+            tables = [entry[name][worker] for entry in entries if worker in entry[name]]
+            if tables:
+                ranked[worker] = (combine(tables).sort_index()
+                                  .sort_values('Présence', ascending=ascending, kind='stable').head(5))
+        return ranked
+    
+    box = pd.concat([entry['box'] for entry in entries])
+    box.index = box.index.astype(dtypes['Service en cours'])
+    updated = {"All Services": {
+        'positions': np.arange(len(data)),
+        'summary': data['Présence'].describe(),
+        'top_5': first_5('top_5', False),
+        'worst_5': first_5('worst_5', True),
+        'avg_presence': combine([entry['avg_presence'] for entry in entries]).reset_index(drop=True),
+        'box': box,
+        'outliers': combine([entry['outliers'] for entry in entries]).sort_index(),
+        'histogram': histogram_bins(data),
+        'anomalies': (combine([entry['anomalies'] for entry in entries]).sort_index()
+                      .sort_values('Robust Z-Score', key=abs, ascending=False, kind='stable'))
+    }}
+    for service, entry in zip(indices, entries):
+        updated[str(service)] = entry
+    return updated
+
+# Session dataset settings (can be overridden with environment variables)
+SESSION_SPILL_DIR = os.environ.get("HR_SESSION_SPILL_DIR", os.path.join(".cache", "sessions"))
+SESSION_IDLE_SECONDS = float(os.environ.get("HR_SESSION_IDLE_SECONDS", "600"))
+SESSION_MEMORY_MB = int(os.environ.get("HR_SESSION_MEMORY_MB", "1024"))
+SESSION_SWEEP_SECONDS = float(os.environ.get("HR_SESSION_SWEEP_SECONDS", "30"))
+
+# Function to remove the spill file of a dataset that is no longer referenced by any session
+def remove_spill_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+# Dataset of one session, held in memory or spilled to a memory-mapped Arrow file
+# Sessions keep the handle and call frame() on every rerun, the manager decides where the data lives
+class DatasetHandle:
+    def __init__(self, manager, df):
+        self.manager = manager
+        self.path = os.path.join(manager.spill_dir, f"{uuid.uuid4().hex}.arrow")
+        self.nbytes = int(df.memory_usage(deep=True).sum())
+        self.df = df
+        self.last_access = time.monotonic()
+        # The file goes away with the handle, i.e. when Streamlit drops the session
+        weakref.finalize(self, remove_spill_file, self.path)
+    
+    def frame(self):
+        return self.manager.frame(self)
+    
+    def resident(self):
+        return self.df is not None
+
+# Keeps the session datasets of this process within a memory ceiling
+# Datasets idle for longer than idle_seconds are spilled to disk by a background thread, and the least
+# recently used ones are spilled whenever the resident datasets exceed max_resident_bytes
+class SessionDataManager:
+    def __init__(self, spill_dir, idle_seconds, max_resident_bytes, sweep_seconds=SESSION_SWEEP_SECONDS):
+        self.spill_dir = spill_dir
+        self.idle_seconds = idle_seconds
+        self.max_resident_bytes = max_resident_bytes
+        self.sweep_seconds = sweep_seconds
+        self.spills = 0
+        self.reloads = 0
+        self._handles = weakref.WeakSet()
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        os.makedirs(spill_dir, exist_ok=True)
+        for name in os.listdir(spill_dir):  # Left over by a previous server process
+            os.remove(os.path.join(spill_dir, name))
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="session-spill", daemon=True)
+        self._sweeper.start()
+    
+    def put(self, df):
+        handle = DatasetHandle(self, df)
+        with self._lock:
+            self._handles.add(handle)
+            self._enforce_ceiling(keep=handle)
+        return handle
+    
+    def frame(self, handle):
+        with self._lock:
+            handle.last_access = time.monotonic()
+            if handle.df is None:
+                handle.df = self._load(handle.path)
+                self.reloads += 1
+                self._enforce_ceiling(keep=handle)
+            return handle.df
+    
+    def resident_bytes(self):
+        with self._lock:
+            return sum(handle.nbytes for handle in list(self._handles) if handle.resident())
+    
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            for handle in list(self._handles):
+                if handle.resident() and now - handle.last_access > self.idle_seconds:
+                    self._spill(handle)
+            self._enforce_ceiling()
+    
+    def close(self):
+        self._stopped.set()
+        self._sweeper.join()
+    
+    def _sweep_loop(self):
+        while not self._stopped.wait(min(self.sweep_seconds, self.idle_seconds / 2)):
+            self.sweep()
+    
+    def _enforce_ceiling(self, keep=None):
+        # The dataset being put or read is never spilled, the session needs it for this rerun
+        total = self.resident_bytes()
+        candidates = sorted((handle for handle in list(self._handles) if handle.resident() and handle is not keep),
+                            key=lambda handle: handle.last_access)
+        for handle in candidates:
+            if total <= self.max_resident_bytes:
+                break
+            if self._spill(handle):
+                total -= handle.nbytes
+    
+    def _spill(self, handle):
+        # Datasets never change once stored, so a file written by an earlier spill is still valid
+        if not os.path.exists(handle.path):
+            try:
+                table = pa.Table.from_pandas(handle.df)
+                with pa.OSFile(f"{handle.path}.tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+                os.replace(f"{handle.path}.tmp", handle.path)
+            except (OSError, pa.ArrowException):
+                # Keep the dataset in memory when it cannot be written
+                remove_spill_file(f"{handle.path}.tmp")
+                return False
+        handle.df = None
+        self.spills += 1
+        return True
+    
+    def _load(self, path):
+        # Numeric columns without nulls keep pointing at the mapped file instead of being copied
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        return table.to_pandas(split_blocks=True)
+
+# Dataset cache settings (can be overridden with environment variables)
+DATASET_CACHE_MAX_MB = int(os.environ.get("HR_DATASET_CACHE_MAX_MB", "512"))
+
+# Function to key a set of uploaded workbooks, identical uploads from several sessions get the same key
+def dataset_cache_key(workbooks, version=PROCESSING_VERSION):
+    digest = hashlib.sha256(version.encode())
+    for source, data in workbooks:
+        digest.update(source.encode() + b"\0" + hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
+# Function to estimate the memory held by a stats cube
+def stats_cube_nbytes(cube):
+    total = 0
+    for entry in cube.values():
+        total += entry['positions'].nbytes + entry['summary'].memory_usage(deep=True)
+        for frame in (entry['avg_presence'], entry['box'], entry['outliers'], entry['anomalies']):
+            total += int(frame.memory_usage(deep=True).sum())
+        edges, counts = entry['histogram']
+        total += edges.nbytes + sum(values.nbytes for values in counts.values())
+        for tables in (entry['top_5'], entry['worst_5']):
+            total += sum(int(table.memory_usage(deep=True).sum()) for table in tables.values())
+    return total
+
+# Columns of the Processed Data table, and the ones it can be sorted by
+TABLE_COLUMNS = ['Matr', 'Nom & Prénom', 'Présence', 'H Supp 75%', 'Congé', 'Feries', 'Chom Tech', 'Observations', 'Source']
+TABLE_SORT_COLUMNS = ['Matr', 'Nom & Prénom', 'Service en cours']
+
+# Sort orders and search index of a dataset, so a page of the Processed Data table is found without sorting
+# or scanning the rows on every render
+class TableIndex:
+    def __init__(self, dataset):
+        self.orders = {}
+        for column in TABLE_SORT_COLUMNS:
+            values = dataset[column].reset_index(drop=True)
+            order = values.sort_values(kind='stable', na_position='last').index.to_numpy(dtype=np.int32)
+            self.orders[column] = (order, int(values.notna().sum()))
+        # One lowercased "matricule name service" string per row, searched with a substring match
+        self.search = (dataset['Matr'].astype(str) + ' ' + dataset['Nom & Prénom'].fillna('').astype(str) + ' '
+                       + dataset['Service en cours'].astype(str)).str.lower().astype(pd.StringDtype("pyarrow"))
+        self.nbytes = sum(order.nbytes for order, _ in self.orders.values()) + int(self.search.memory_usage(deep=True))
+    
+    # Returns the rows matching the query, in the requested order
+    def positions(self, query='', sort_column=None, descending=False):
+        if sort_column is None:
+            order = np.arange(len(self.search), dtype=np.int32)
+        else:
+            order, valid = self.orders[sort_column]
+            if descending:
+                order = np.concatenate([order[:valid][::-1], order[valid:]])  # Empty values stay last
+        query = query.strip().lower()
+        if query:
+            matches = self.search.str.contains(query, regex=False).to_numpy(dtype=bool, na_value=False)
+            order = order[matches[order]]
+        return order
+
+# Columns describing the employees of a change summary
+CHANGE_COLUMNS = ['Source', 'Matr', 'Nom & Prénom', 'Service en cours', 'Présence']
+
+# Function to fingerprint each row of a dataset from its values, whatever width its numbers were downcast to
+def row_fingerprints(dataset):
+    values = dataset.astype({column: float for column in dataset.columns
+                             if pd.api.types.is_numeric_dtype(dataset[column])})
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+# Function to key the rows of a dataset by source and Matricule, numbered when a Matricule repeats within a source
+# The keys are hashed so that they are matched as integers
+def row_keys(dataset):
+    matr = dataset['Matr']
+    keys = pd.DataFrame({
+        'source': dataset['Source'].astype(str),
+        'matr': matr.astype(float) if pd.api.types.is_numeric_dtype(matr) else matr.astype(str)
+    })
+    keys['occurrence'] = keys.groupby(['source', 'matr'], dropna=False).cumcount()
+    return pd.Index(pd.util.hash_pandas_object(keys, index=False).to_numpy())
+
+# Function to name the columns that differ between two aligned sets of rows, one string per row
+def changed_columns(before, after):
+    differs = []
+    for column in after.columns.intersection(before.columns):
+        old = before[column].to_numpy(dtype=object)
+        new = after[column].to_numpy(dtype=object)
+        # Only present values are compared, == on pd.NA has no truth value
+        missing_old, missing_new = pd.isna(old), pd.isna(new)
+        present = ~(missing_old | missing_new)
+        equal = missing_old & missing_new
+        equal[present] = old[present] == new[present]
+        differs.append((column, ~equal))
+    return [', '.join(column for column, mask in differs if mask[i]) for i in range(len(after))]
+
+# Function to compare a dataset with its previous version, employee by employee
+# Returns the added, removed and changed employees, the services they belong to and the report tables
+# (chunks of REPORT_CHUNK_SIZE rows) whose content differs from the previous report
+def diff_datasets(previous, previous_fingerprints, dataset, fingerprints):
+    matches = row_keys(previous).get_indexer(row_keys(dataset))  # Previous position of each row, -1 when added
+    found = matches >= 0
+    changed = found.copy()
+    changed[found] = previous_fingerprints[matches[found]] != fingerprints[found]
+    removed = np.ones(len(previous), dtype=bool)
+    removed[matches[found]] = False
+    
+    added_positions = np.flatnonzero(~found)
+    changed_positions = np.flatnonzero(changed)
+    previous_positions = matches[changed]
+    removed_positions = np.flatnonzero(removed)
+    services = set(dataset['Service en cours'].iloc[np.concatenate([added_positions, changed_positions])].astype(str))
+    services.update(previous['Service en cours'].iloc[np.concatenate([removed_positions, previous_positions])].astype(str))
+    
+    # Report tables are compared position by position, rows shift when employees are added or removed
+    common = min(len(previous), len(dataset))
+    total_chunks = -(-len(dataset) // REPORT_CHUNK_SIZE)
+    chunks = set((np.flatnonzero(previous_fingerprints[:common] != fingerprints[:common]) // REPORT_CHUNK_SIZE).tolist())
+    if len(previous) != len(dataset):
+        chunks.update(range(common // REPORT_CHUNK_SIZE, total_chunks))
+    
+    before = previous.iloc[previous_positions]
+    after = dataset.iloc[changed_positions]
+    return {
+        'added': dataset.iloc[added_positions][CHANGE_COLUMNS],
+        'removed': previous.iloc[removed_positions][CHANGE_COLUMNS],
+        'changed': after[CHANGE_COLUMNS].assign(**{
+            'Previous Présence': before['Présence'].to_numpy(),
+            'Changed Columns': changed_columns(before, after)
+        }),
+        'unchanged': int(found.sum() - changed.sum()),
+        'services': services,
+        'chunks': sorted(chunks),
+        'total_chunks': total_chunks
+    }
+
+# Processed dataset shared by every session that uploaded the same workbooks, with the results derived from it
+# Sessions only read it: with pandas copy-on-write, a change made by one session never reaches the shared frame
+# When the previous version of the same files is given, only the stats of the services with changed rows are recomputed
+class SharedDataset:
+    def __init__(self, handle, duplicates, read_stats, previous=None):
+        dataset = handle.frame()
+        self.handle = handle
+        self.key = dataset_fingerprint(dataset)
+        self.fingerprints = row_fingerprints(dataset)
+        self.changes = None
+        before = previous.handle.frame() if previous is not None else None
+        # Versions whose columns or Matricule types differ are not compared, Matricules would not match
+        if (before is not None and list(before.columns) == list(dataset.columns)
+                and before['Matr'].dtype.kind == dataset['Matr'].dtype.kind):
+            with timed_stage('ingest.diff', len(dataset)):
+                self.changes = diff_datasets(before, previous.fingerprints, dataset, self.fingerprints)
+            self.changes['previous_key'] = previous.key
+        with timed_stage('stats.cube', len(dataset)):
+            if self.changes is None:
+                self.stats_cube = build_stats_cube(dataset)
+            else:
+                self.stats_cube = update_stats_cube(previous.stats_cube, dataset, self.changes['services'])
+        with timed_stage('stats.table_index', len(dataset)):
+            self.table_index = TableIndex(dataset)
+        self.duplicates = duplicates
+        self.read_stats = read_stats
+        self.nbytes = (handle.nbytes + stats_cube_nbytes(self.stats_cube) + self.table_index.nbytes
+                       + self.fingerprints.nbytes + int(duplicates.memory_usage(deep=True).sum()))
+
+# Datasets being processed, keyed like the dataset cache, so that an upload of files another session is
+# already processing waits for that result instead of processing them again
+class DatasetLoads:
+    def __init__(self):
+        self._loads = {}
+        self._lock = threading.Lock()
+    
+    # Returns the future of the load of a key and whether the caller owns it (and must finish it)
+    def claim(self, key):
+        with self._lock:
+            future = self._loads.get(key)
+            if future is not None:
+                return future, False
+            future = self._loads[key] = Future()
+            return future, True
+    
+    def finish(self, key, future, shared=None, error=None):
+        with self._lock:
+            del self._loads[key]
+        if error is None:
+            future.set_result(shared)
+        else:
+            future.set_exception(error)
+
+# Function to get the shared dataset of some workbooks, processing them only when no session has done so yet
+# The lineage maps the file names of each upload to its dataset, so that a corrected re-upload of the same files
+# is compared with the previous version while that one is still cached. It is a weakref.WeakValueDictionary,
+# so an entry is dropped with its dataset when the cache evicts it
+# With loads, a second upload of the same files waits for the first one; if that one is cancelled, it takes over
+def load_dataset(workbooks, dataset_cache, session_data, ingestion_cache=None, executor=None, lineage=None,
+                 loads=None, progress=None):
+    key = dataset_cache_key(workbooks)
+    sources = tuple(sorted(source for source, _ in workbooks))
+    shared = dataset_cache.get(key)
+    while shared is None:
+        future, owner = loads.claim(key) if loads is not None else (None, True)
+        if not owner:
+            while not wait([future], timeout=0.5).done:
+                if progress is not None:
+                    progress(None, 'ingest.shared', 0)  # Lets this job be cancelled while it waits
+            if not isinstance(future.exception(), JobCancelled):
+                shared = future.result()
+            continue
+        try:
+            shared = dataset_cache.get(key)  # Another load may have finished since the first look
+            if shared is None:
+                shared = process_dataset(workbooks, session_data, ingestion_cache, executor,
+                                         lineage.get(sources) if lineage is not None else None, progress)
+                dataset_cache.put(key, shared)
+        except BaseException as error:
+            if future is not None:
+                loads.finish(key, future, error=error)
+            raise
+        if future is not None:
+            loads.finish(key, future, shared)
+    if lineage is not None:
+        lineage[sources] = shared
+    return shared
+
+# Function to process some workbooks into a shared dataset, compared with the previous version of the same files if given
+def process_dataset(workbooks, session_data, ingestion_cache, executor, previous, progress):
+    original_df, output_df, duplicates, read_stats = process_workbooks(workbooks, ingestion_cache, executor, progress)
+    if progress is not None:
+        progress(None, 'ingest.compact', len(output_df))
+    with timed_stage('ingest.compact', len(output_df)):
+        dataset = compact_dataset(original_df, output_df)
+    if progress is not None:
+        progress(None, 'stats.cube', len(dataset))
+    return SharedDataset(session_data.put(dataset), duplicates, read_stats, previous)
+
+# History store settings (can be overridden with environment variables)
+HISTORY_DB = os.environ.get("HR_HISTORY_DB", os.path.join("data", "history.sqlite3"))
+PERIOD_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")  # Periods are months, e.g. 2025-06
+
+# Tables of the history store: one row per employee and period, indexed by period, Matricule and service,
+# and the service averages of each period, computed when the period is saved
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS periods (
+    period TEXT PRIMARY KEY,
+    dataset_key TEXT NOT NULL,
+    employees INTEGER NOT NULL,
+    saved_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attendance (
+    period TEXT NOT NULL,
+    matr TEXT NOT NULL,
+    name TEXT,
+    service TEXT,
+    worker_type TEXT,
+    source TEXT,
+    presence REAL,
+    h_supp REAL,
+    conge REAL,
+    feries REAL,
+    chom_tech REAL
+);
+CREATE INDEX IF NOT EXISTS attendance_period ON attendance (period);
+CREATE INDEX IF NOT EXISTS attendance_matr ON attendance (matr, period);
+CREATE INDEX IF NOT EXISTS attendance_service ON attendance (service, period);
+CREATE TABLE IF NOT EXISTS service_months (
+    period TEXT NOT NULL,
+    service TEXT NOT NULL,
+    worker_type TEXT NOT NULL,
+    employees INTEGER NOT NULL,
+    avg_presence REAL,
+    PRIMARY KEY (period, service, worker_type)
+);
+"""
+
+# Columns of the session dataset stored in the attendance table
+HISTORY_COLUMNS = {
+    'Matr': 'matr', 'Nom & Prénom': 'name', 'Service en cours': 'service', 'Worker Type': 'worker_type',
+    'Source': 'source', 'Présence': 'presence', 'H Supp 75%': 'h_supp', 'Congé': 'conge', 'Feries': 'feries',
+    'Chom Tech': 'chom_tech'
+}
+
+# Local SQLite store of the processed datasets of every period, for trends across months without the workbooks
+# Saving a period replaces what was stored for it; each call opens its own connection so sessions can share it
+class HistoryStore:
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")  # Readers are not blocked while a period is saved
+            connection.executescript(HISTORY_SCHEMA)
+    
+    # Opens a connection for one transaction, committed when the block succeeds
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+    
+    # Function to convert rows of a session dataset to rows of the attendance table
+    @staticmethod
+    def _rows(dataset):
+        rows = pd.DataFrame({column: dataset[source] if source in dataset.columns else None
+                             for source, column in HISTORY_COLUMNS.items()})
+        rows['matr'] = rows['matr'].astype(str)
+        for column in ['name', 'service', 'worker_type', 'source']:
+            rows[column] = rows[column].astype(object)
+        for column in ['presence', 'h_supp', 'conge', 'feries', 'chom_tech']:
+            rows[column] = pd.to_numeric(rows[column], errors='coerce').astype(float)
+        return rows.astype(object).where(rows.notna(), None)
+    
+    # Saves the dataset of a period, returns False when the same dataset is already stored for it
+    # With the changes from the stored version (see diff_datasets), only the changed employees are rewritten
+    def save_period(self, period, dataset, dataset_key, changes=None):
+        if not PERIOD_PATTERN.match(period):
+            raise ValueError(f"Period '{period}' is not a month in the YYYY-MM format")
+        
+        with self._connect() as connection:
+            stored = connection.execute("SELECT dataset_key FROM periods WHERE period = ?", (period,)).fetchone()
+            if stored is not None and stored[0] == dataset_key:
+                return False
+            if stored is not None and changes is not None and stored[0] == changes['previous_key']:
+                self._update_period(connection, period, dataset, changes)
+                connection.execute("UPDATE periods SET dataset_key = ?, employees = ?, saved_at = ? WHERE period = ?",
+                                   (dataset_key, len(dataset), datetime.now().isoformat(timespec="seconds"), period))
+                return True
+            
+            rows = self._rows(dataset)
+            months = (rows.groupby(['service', 'worker_type'])['presence']
+                      .agg(employees='size', avg_presence='mean').reset_index())
+            for table in ['attendance', 'service_months', 'periods']:
+                connection.execute(f"DELETE FROM {table} WHERE period = ?", (period,))
+            connection.executemany(
+                f"INSERT INTO attendance (period, {', '.join(HISTORY_COLUMNS.values())}) "
+                f"VALUES (?, {', '.join('?' * len(HISTORY_COLUMNS))})",
+                ((period, *row) for row in rows.itertuples(index=False, name=None))
+            )
+            connection.executemany(
+                "INSERT INTO service_months VALUES (?, ?, ?, ?, ?)",
+                ((period, service, worker, int(employees), None if pd.isna(average) else float(average))
+                 for service, worker, employees, average in months.itertuples(index=False, name=None))
+            )
+            connection.execute("INSERT INTO periods VALUES (?, ?, ?, ?)",
+                               (period, dataset_key, len(rows), datetime.now().isoformat(timespec="seconds")))
+        return True
+    
+    # Rewrites the employees that were added, removed or changed, then the averages of the services they belong to
+    def _update_period(self, connection, period, dataset, changes):
+        employees = pd.concat([changes[name][['Source', 'Matr']] for name in ['added', 'removed', 'changed']])
+        keys = set(zip(employees['Source'].astype(str), employees['Matr'].astype(str)))
+        connection.executemany("DELETE FROM attendance WHERE period = ? AND matr = ? AND source = ?",
+                               ((period, matr, source) for source, matr in keys))
+        
+        candidates = dataset[dataset['Matr'].isin(employees['Matr'])]
+        selected = pd.MultiIndex.from_arrays([candidates['Source'].astype(str), candidates['Matr'].astype(str)])
+        rows = self._rows(candidates[selected.isin(list(keys))])
+        connection.executemany(
+            f"INSERT INTO attendance (period, {', '.join(HISTORY_COLUMNS.values())}) "
+            f"VALUES (?, {', '.join('?' * len(HISTORY_COLUMNS))})",
+            ((period, *row) for row in rows.itertuples(index=False, name=None))
+        )
+        
+        services = sorted(changes['services'])
+        for service in services:
+            connection.execute("DELETE FROM service_months WHERE period = ? AND service = ?", (period, service))
+            connection.execute(
+                "INSERT INTO service_months SELECT period, service, worker_type, COUNT(*), AVG(presence) "
+                "FROM attendance WHERE period = ? AND service = ? AND worker_type IS NOT NULL "
+                "GROUP BY service, worker_type", (period, service)
+            )
+    
+    def periods(self):
+        with self._connect() as connection:
+            return pd.read_sql_query("SELECT period, employees, saved_at FROM periods ORDER BY period", connection)
+    
+    # Presence of one employee in every stored period
+    def employee_history(self, matr):
+        with self._connect() as connection:
+            return pd.read_sql_query(
+                "SELECT period, name, service, worker_type, presence, h_supp, conge, feries, chom_tech "
+                "FROM attendance WHERE matr = ? ORDER BY period", connection, params=(str(matr).strip(),)
+            )
+    
+    # Average presence per service, worker type and period, optionally for some services only
+    def service_averages(self, services=None):
+        query = "SELECT period, service, worker_type, employees, avg_presence FROM service_months"
+        params = ()
+        if services:
+            query += f" WHERE service IN ({', '.join('?' * len(services))})"
+            params = tuple(services)
+        with self._connect() as connection:
+            return pd.read_sql_query(query + " ORDER BY period, service, worker_type", connection, params=params)
+    
+    def services(self):
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute("SELECT DISTINCT service FROM service_months ORDER BY service")]
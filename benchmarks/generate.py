@@ -0,0 +1,96 @@
+import argparse
+import sys
+from datetime import timedelta
+
+import numpy as np
+from openpyxl import Workbook
+
+# Header row of the "Etat Fin de Periode" export, in the production column order
+HEADERS = [
+    "Matricule", "Nom", "Prénom", "Heures Normales", "H SUP 75% Hebdomadaire 24/5-23/6",
+    "Nombre de jours fériés 24/5-23/6", "Chomage technique 24/5-23/6", "Congé annuel 24/5-23/6",
+    "Service en cours", "Catégorie", "Date Embauche", "Jours de Présences 24/5-23/6",
+    "Absences 24/5-23/6", "Retards 24/5-23/6"
+]
+
+LAST_NAMES = ["BEN ALI", "TRABELSI", "GHARBI", "HAMMAMI", "JEBALI", "MEJRI", "BOUAZIZI", "SASSI", "KHELIFI",
+              "DRIDI", "CHAOUACHI", "BEN SALAH", "AYARI", "HAMDI", "NASRI", "MANSOUR", "OUESLATI", "ZOUARI"]
+FIRST_NAMES = ["Mohamed", "Ahmed", "Amira", "Fatma", "Youssef", "Ines", "Sami", "Mariem", "Walid", "Sarra",
+               "Hichem", "Nour", "Karim", "Rania", "Bilel", "Salma", "Anis", "Hela", "Khaled", "Asma"]
+SERVICES = ["Production", "Qualité", "Maintenance", "Logistique", "Magasin", "Méthodes", "Achats",
+            "Ressources Humaines", "Finance", "Informatique", "Sécurité", "Stérilisation", "Conditionnement",
+            "Injection", "Extrusion", "Assemblage", "Contrôle", "Expédition", "Réception", "Nettoyage",
+            "Direction", "Commercial", "R&D", "Laboratoire"]
+CATEGORIES = ["Ouvrier", "Employé", "Agent de maîtrise", "Cadre"]
+
+# Function to generate the row values of a synthetic attendance export
+# About 60% of the workers are hourly (blank Jours de Présences), their hours mix Timedelta cells,
+# "HH:MM" strings, plain numbers, blanks and a few unreadable values like the real exports
+def generate_rows(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    hourly = rng.random(rows) < 0.6
+    hour_kind = rng.random(rows)
+    hours = rng.integers(120, 208, rows)
+    minutes = rng.integers(0, 60, rows)
+    leave_days = rng.integers(1, 6, rows)
+    leave_kind = rng.random(rows)
+    for i in range(rows):
+        if hour_kind[i] < 0.4:
+            heures_normales = timedelta(hours=int(hours[i]), minutes=int(minutes[i]))
+        elif hour_kind[i] < 0.7:
+            heures_normales = f"{hours[i]}:{minutes[i]:02d}"
+        elif hour_kind[i] < 0.9:
+            heures_normales = float(hours[i])
+        elif hour_kind[i] < 0.98:
+            heures_normales = None
+        else:
+            heures_normales = "n/a"
+        
+        if leave_kind[i] < 0.7:
+            conge = None
+        elif leave_kind[i] < 0.85:
+            conge = int(leave_days[i])
+        else:
+            conge = timedelta(hours=int(leave_days[i]))
+        
+        yield [
+            10000 + i,
+            LAST_NAMES[rng.integers(len(LAST_NAMES))],
+            FIRST_NAMES[rng.integers(len(FIRST_NAMES))],
+            heures_normales,
+            int(rng.integers(0, 12)),
+            int(rng.integers(0, 3)),
+            None if rng.random() < 0.9 else int(rng.integers(1, 5)),
+            conge,
+            SERVICES[min(int(rng.exponential(5)), len(SERVICES) - 1)] if rng.random() < 0.98 else None,
+            CATEGORIES[rng.integers(len(CATEGORIES))],
+            f"{rng.integers(1, 29):02d}/{rng.integers(1, 13):02d}/{rng.integers(2000, 2025)}",
+            None if hourly[i] else int(rng.integers(15, 27)),
+            int(rng.integers(0, 4)),
+            int(rng.integers(0, 6))
+        ]
+
+# Function to write a synthetic attendance workbook
+def write_workbook(path, rows, seed=0):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Feuil1")
+    ws.append(HEADERS)
+    for row in generate_rows(rows, seed):
+        ws.append(row)
+    wb.save(path)
+
+
+# Entry point: python -m benchmarks.generate ROWS OUTPUT.xlsx [--seed N]
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic 'Etat Fin de Periode' attendance workbook.")
+    parser.add_argument("rows", type=int, help="Number of employees")
+    parser.add_argument("output", help="Path of the .xlsx file to write")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    args = parser.parse_args(argv)
+    write_workbook(args.output, args.rows, args.seed)
+    print(f"Wrote {args.output} ({args.rows} employees)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
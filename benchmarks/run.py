@@ -0,0 +1,211 @@
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+
+from attendance import (
+    TableIndex, build_stats_cube, clean_time_column, compact_dataset, compute_presence, create_styled_excel,
+    merge_workbooks, parse_excel_file, peak_rss_mb, read_workbook, write_csv_report, write_parquet_report
+)
+from benchmarks.generate import write_workbook
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [1000, 10000, 100000, 500000]
+
+
+# Function to parse the command line arguments
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Time the attendance processing stages on synthetic workbooks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Numbers of employees to benchmark (default: 1k, 10k, 100k and 500k)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generated workbooks")
+    parser.add_argument("--data-dir", default=os.path.join(BENCHMARK_DIR, "data"),
+                        help="Where generated workbooks are kept between runs")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--no-memory", action="store_true", help="Only record wall time")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per size, the fastest time of each stage is kept (default: 3)")
+    parser.add_argument("--compare", help="Earlier result file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown against --compare before failing (default: 0.2 = 20%%)")
+    parser.add_argument("--min-slowdown", type=float, default=0.05,
+                        help="Slowdowns smaller than this many seconds never fail, whatever the ratio (default: 0.05)")
+    return parser.parse_args(argv)
+
+# Function to read a memory figure of this process from /proc, in MB
+def proc_status_mb(field):
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+# Peak memory of a stage above what the process held before it started
+# On Linux the resident set high-water mark is reset before each stage, which costs nothing while it runs;
+# elsewhere allocations are traced with tracemalloc, which slows the stages down noticeably
+class MemoryProbe:
+    def __init__(self):
+        self.method = "rss" if os.path.exists("/proc/self/clear_refs") else "tracemalloc"
+        self.baseline = 0.0
+        if self.method == "tracemalloc":
+            tracemalloc.start()
+    
+    def start(self):
+        if self.method == "rss":
+            with open("/proc/self/clear_refs", "w") as clear_refs:
+                clear_refs.write("5")  # Reset VmHWM to the current resident set size
+            self.baseline = proc_status_mb("VmRSS")
+        else:
+            tracemalloc.reset_peak()
+            self.baseline = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    
+    def peak_mb(self):
+        if self.method == "rss":
+            return round(proc_status_mb("VmHWM") - self.baseline, 2)
+        return round(tracemalloc.get_traced_memory()[1] / 1024 / 1024 - self.baseline, 2)
+    
+    def stop(self):
+        if self.method == "tracemalloc":
+            tracemalloc.stop()
+
+# Times a stage and records its peak memory when a probe is given
+@contextmanager
+def stage(stages, name, memory):
+    if memory is not None:
+        memory.start()
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    result = {"seconds": round(seconds, 4)}
+    if memory is not None:
+        result["peak_mb"] = memory.peak_mb()
+    stages[name] = result
+    print(f"  {name:<22} {seconds:8.3f} s" + (f" {result['peak_mb']:9.1f} MB" if memory is not None else ""))
+
+# Function to get the generated workbook of a size, writing it on first use
+def workbook_path(data_dir, rows, seed):
+    path = os.path.join(data_dir, f"attendance_{rows}_{seed}.xlsx")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        print(f"Generating {path}")
+        write_workbook(path, rows, seed)
+    return path
+
+# Function to run every stage on one workbook
+# The parse stages repeat the steps of parse_excel_file one by one, then the whole function is timed too
+def benchmark(path, memory):
+    stages = {}
+    with stage(stages, "read_workbook", memory):
+        df, _ = read_workbook(path)
+    with stage(stages, "clean_time_columns", memory):
+        df['Heures Normales'] = clean_time_column(df['Heures Normales'])[0]
+        df['Congé annuel 24/5-23/6'] = clean_time_column(df['Congé annuel 24/5-23/6'])[0]
+    with stage(stages, "compute_presence", memory):
+        compute_presence(df)
+    with stage(stages, "parse_excel_file", memory):
+        original_df, output_df, _ = parse_excel_file(path)
+    original_df, output_df, _ = merge_workbooks([("benchmark", original_df, output_df)])
+    with stage(stages, "compact_dataset", memory):
+        dataset = compact_dataset(original_df, output_df)
+    with stage(stages, "build_stats_cube", memory):
+        build_stats_cube(dataset)
+    with stage(stages, "table_index", memory):
+        TableIndex(dataset)
+    with stage(stages, "create_styled_excel", memory):
+        create_styled_excel(dataset, io.BytesIO())
+    with stage(stages, "write_csv_report", memory):
+        write_csv_report(dataset, io.BytesIO())
+    with stage(stages, "write_parquet_report", memory):
+        write_parquet_report(dataset, io.BytesIO())
+    return stages
+
+# Function to merge repeated runs of the stages: the fastest time and the highest peak memory of each stage
+def best_of(runs):
+    stages = {}
+    for name in runs[0]:
+        results = [run[name] for run in runs]
+        stages[name] = {"seconds": min(result["seconds"] for result in results)}
+        if "peak_mb" in results[0]:
+            stages[name]["peak_mb"] = max(result["peak_mb"] for result in results)
+    return stages
+
+# Function to get the commit being benchmarked, if this is a git checkout
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=BENCHMARK_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Function to compare with an earlier result file, returns the stages slower than allowed
+# A stage only counts as slower when it exceeds both the ratio tolerance and the minimum slowdown in seconds
+def compare(results, baseline_path, tolerance, min_slowdown):
+    with open(baseline_path) as baseline_file:
+        baseline = {run["rows"]: run["stages"] for run in json.load(baseline_file)["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        for name, result in run["stages"].items():
+            before = baseline.get(run["rows"], {}).get(name)
+            if before is None or not before["seconds"]:
+                continue
+            ratio = result["seconds"] / before["seconds"]
+            print(f"{run['rows']:>8} {name:<22} {before['seconds']:8.3f} s -> {result['seconds']:8.3f} s ({ratio:5.2f}x)")
+            if ratio > 1 + tolerance and result["seconds"] - before["seconds"] > min_slowdown:
+                regressions.append((run["rows"], name, ratio))
+    return regressions
+
+# Entry point: python -m benchmarks.run [--sizes 1000 10000] [--compare benchmarks/results/<earlier>.json]
+def main(argv=None):
+    args = parse_args(argv)
+    memory = None if args.no_memory else MemoryProbe()
+    results = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "openpyxl": openpyxl.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "memory": memory.method if memory is not None else None,
+        "repeat": max(1, args.repeat),
+        "runs": []
+    }
+    
+    for rows in args.sizes:
+        path = workbook_path(args.data_dir, rows, args.seed)
+        runs = []
+        for repeat in range(max(1, args.repeat)):
+            print(f"{rows} employees (run {repeat + 1}/{max(1, args.repeat)})")
+            runs.append(benchmark(path, memory))
+        results["runs"].append({"rows": rows, "stages": best_of(runs)})
+    if memory is not None:
+        memory.stop()
+    results["peak_rss_mb"] = peak_rss_mb()
+    
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Wrote {output}")
+    
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance, args.min_slowdown)
+        for rows, name, ratio in regressions:
+            print(f"Regression: {name} is {ratio:.2f}x slower at {rows} employees", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
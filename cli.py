@@ -0,0 +1,102 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from attendance import (
+    CACHE_DIR, CACHE_MAX_DISK_MB, CACHE_MAX_ENTRIES, HISTORY_DB, PERIOD_PATTERN, PROCESSING_VERSION,
+    REPORT_WRITERS, HistoryStore, IngestionCache, compact_dataset, dataset_fingerprint, process_workbooks,
+    write_service_reports
+)
+
+
+# Function to parse the command line arguments
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Convert a directory of attendance workbooks into styled 'Etat de pointage' reports."
+    )
+    parser.add_argument("input_dir", help="Directory containing the .xlsx attendance exports")
+    parser.add_argument("output_dir", help="Directory where the reports are written")
+    parser.add_argument("--merge", action="store_true",
+                        help="Write one consolidated report instead of one report per workbook")
+    parser.add_argument("--per-service", action="store_true",
+                        help="Also write a zip archive with one styled report per service")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of workbooks parsed, or service reports built, in parallel (default: one per core)")
+    parser.add_argument("--format", dest="formats", action="append", choices=sorted(REPORT_WRITERS),
+                        help="Report format, repeat for several (default: xlsx, the styled workbook)")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the ingestion cache")
+    parser.add_argument("--period", help="Also save the merged dataset to the history store under this month (YYYY-MM)")
+    parser.add_argument("--log-stages", action="store_true",
+                        help="Write the duration, rows and memory delta of each processing stage to stderr as JSON lines")
+    return parser.parse_args(argv)
+
+# Function to write one report in each requested format
+def write_report(df, path, formats):
+    for report_format in formats:
+        with open(f"{path}.{report_format}", "wb") as output:
+            REPORT_WRITERS[report_format](df, output)
+        print(f"Wrote {path}.{report_format} ({len(df)} employees)")
+
+# Entry point: python cli.py INPUT_DIR OUTPUT_DIR [--merge] [--format FORMAT ...]
+def main(argv=None):
+    args = parse_args(argv)
+    if args.log_stages:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.period and not PERIOD_PATTERN.match(args.period):
+        print(f"Period '{args.period}' is not a month in the YYYY-MM format", file=sys.stderr)
+        return 2
+    names = sorted(name for name in os.listdir(args.input_dir)
+                   if name.lower().endswith(".xlsx") and not name.startswith("~$"))
+    if not names:
+        print(f"No .xlsx files found in {args.input_dir}", file=sys.stderr)
+        return 1
+    
+    workbooks = []
+    for name in names:
+        with open(os.path.join(args.input_dir, name), "rb") as workbook:
+            workbooks.append((os.path.splitext(name)[0], workbook.read()))
+    
+    cache = None
+    if not args.no_cache:
+        cache = IngestionCache(CACHE_DIR, CACHE_MAX_ENTRIES, CACHE_MAX_DISK_MB * 1024 * 1024, PROCESSING_VERSION)
+    
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        original_df, output_df, duplicates, read_stats = process_workbooks(workbooks, cache, executor)
+    for stats in read_stats:
+        cached = " (cached result of an earlier read)" if stats['cached'] else ""
+        print(f"Read {stats['source']}: {stats['rows']} rows in {stats['seconds']:.2f} s{cached}")
+        if stats['coerced_time_cells']:
+            print(f"  {stats['coerced_time_cells']} time value(s) could not be read and were set to 0")
+    if not duplicates.empty:
+        print(f"Warning: {duplicates['Matr'].nunique()} Matricule(s) appear in more than one file", file=sys.stderr)
+    
+    if args.period:
+        dataset = compact_dataset(original_df, output_df)
+        if HistoryStore(HISTORY_DB).save_period(args.period, dataset, dataset_fingerprint(dataset)):
+            print(f"Saved {len(dataset)} employees to the history for {args.period}")
+        else:
+            print(f"The history already holds this dataset for {args.period}")
+    
+    os.makedirs(args.output_dir, exist_ok=True)
+    formats = args.formats or ["xlsx"]
+    if args.merge:
+        write_report(output_df, os.path.join(args.output_dir, "etat_de_pointage"), formats)
+    else:
+        for source, df in output_df.groupby('Source', sort=False):
+            write_report(df, os.path.join(args.output_dir, f"{source}_etat_de_pointage"), formats)
+    if args.per_service:
+        path = os.path.join(args.output_dir, "etat_de_pointage_par_service.zip")
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor, open(path, "wb") as output:
+            write_service_reports(output_df, output, executor)
+        print(f"Wrote {path} ({output_df['Service en cours'].nunique()} services)")
+    
+    print(f"Done in {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
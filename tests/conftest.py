@@ -0,0 +1,31 @@
+import io
+
+from openpyxl import Workbook
+
+from attendance import compact_dataset, merge_workbooks, parse_workbook_bytes
+from benchmarks.generate import HEADERS, generate_rows
+
+
+# Function to generate the rows of an attendance export, blanking the Prénom of the given rows
+def attendance_rows(count, seed=0, blank_names=()):
+    rows = list(generate_rows(count, seed))
+    for index in blank_names:
+        rows[index][HEADERS.index("Prénom")] = None
+    return rows
+
+# Function to write attendance rows as the bytes of an .xlsx export
+def workbook_bytes(rows):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Feuil1")
+    ws.append(HEADERS)
+    for row in rows:
+        ws.append(row)
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+# Function to parse attendance rows into the compacted dataset the app keeps per session
+def compacted_dataset(rows, source="site"):
+    original_df, output_df, _ = parse_workbook_bytes(workbook_bytes(rows))
+    original_df, output_df, _ = merge_workbooks([(source, original_df, output_df)])
+    return compact_dataset(original_df, output_df)
@@ -0,0 +1,101 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from attendance import build_stats_cube, changed_columns, diff_datasets, row_fingerprints, update_stats_cube
+from benchmarks.generate import HEADERS
+from tests.conftest import attendance_rows, compacted_dataset
+
+PRENOM = HEADERS.index("Prénom")
+HEURES = HEADERS.index("Heures Normales")
+H_SUP = HEADERS.index("H SUP 75% Hebdomadaire 24/5-23/6")
+JOURS = HEADERS.index("Jours de Présences 24/5-23/6")
+
+
+# Function to compare two stats cubes entry by entry
+def assert_cubes_equal(actual, expected):
+    assert list(actual) == list(expected)
+    for service in expected:
+        a, e = actual[service], expected[service]
+        assert np.array_equal(a['positions'], e['positions']), service
+        pd.testing.assert_series_equal(a['summary'], e['summary'])
+        for name in ['avg_presence', 'box', 'outliers', 'anomalies']:
+            pd.testing.assert_frame_equal(a[name], e[name], obj=f"{service} {name}")
+        for name in ['top_5', 'worst_5']:
+            assert list(a[name]) == list(e[name])
+            for worker in e[name]:
+                pd.testing.assert_frame_equal(a[name][worker], e[name][worker], obj=f"{service} {name} {worker}")
+        assert np.array_equal(a['histogram'][0], e['histogram'][0])
+        assert list(a['histogram'][1]) == list(e['histogram'][1])
+        for worker in e['histogram'][1]:
+            assert np.array_equal(a['histogram'][1][worker], e['histogram'][1][worker])
+
+# Rows of the first upload, row 2 has a blank name
+BASE = attendance_rows(80, blank_names=[2])
+
+# Function to apply corrections to the rows of the first upload
+def corrected(edit=True, add=False, remove=False):
+    rows = copy.deepcopy(BASE)
+    if edit:
+        rows[2][H_SUP] = 999  # Row with a blank name
+        rows[4][PRENOM] = None  # Name blanked
+        rows[5][HEURES], rows[5][JOURS] = 300.0, None  # Presence changed
+    if add:
+        rows.append(rows[0][:1] + rows[0][1:])
+        rows[-1][0] = 99999
+    if remove:
+        del rows[10]
+    return rows
+
+
+def test_changed_columns_with_missing_values():
+    before = pd.DataFrame({
+        'Nom & Prénom': pd.Series([pd.NA, pd.NA, 'A B', 'A B'], dtype=pd.StringDtype("pyarrow")),
+        'Présence': [1.0, 2.0, np.nan, 4.0],
+        'Observations': pd.Series([None, 'x', 'y', pd.NA], dtype=object)
+    })
+    after = pd.DataFrame({
+        'Nom & Prénom': pd.array([pd.NA, 'C D', pd.NA, 'A B'], dtype=pd.StringDtype("pyarrow")),
+        'Présence': [1.0, 2.5, np.nan, 4.0],
+        'Observations': pd.array([pd.NA, 'x', 'z', pd.NA], dtype=object)
+    }, index=[10, 11, 12, 13])  # Rows are aligned by position, not by index
+    assert changed_columns(before, after) == ['', 'Nom & Prénom, Présence', 'Nom & Prénom, Observations', '']
+
+def test_diff_datasets_added_removed_and_changed_rows():
+    previous = compacted_dataset(BASE)
+    dataset = compacted_dataset(corrected(add=True, remove=True))
+    changes = diff_datasets(previous, row_fingerprints(previous), dataset, row_fingerprints(dataset))
+    
+    assert changes['added']['Matr'].tolist() == [99999]
+    assert changes['removed']['Matr'].tolist() == [10010]
+    changed = dict(zip(changes['changed']['Matr'], changes['changed']['Changed Columns']))
+    assert sorted(changed) == [10002, 10004, 10005]
+    assert changed[10002] == 'H Supp 75%'
+    assert changed[10004] == 'Nom & Prénom'
+    assert 'Présence' in changed[10005]
+    assert changes['unchanged'] == 80 - 1 - 3
+    
+    expected_services = {BASE[i][HEADERS.index("Service en cours")] for i in [0, 2, 4, 5, 10]}
+    assert changes['services'] == expected_services
+    # Rows after the removed one moved up, so every table from the first one on differs
+    assert changes['chunks'] == [0, 1, 2, 3]
+    assert changes['total_chunks'] == 4
+
+def test_diff_datasets_same_upload():
+    previous = compacted_dataset(BASE)
+    dataset = compacted_dataset(copy.deepcopy(BASE))
+    changes = diff_datasets(previous, row_fingerprints(previous), dataset, row_fingerprints(dataset))
+    assert changes['added'].empty and changes['removed'].empty and changes['changed'].empty
+    assert changes['unchanged'] == 80
+    assert changes['services'] == set() and changes['chunks'] == []
+
+@pytest.mark.parametrize("add, remove", [(False, False), (True, False), (False, True), (True, True)],
+                         ids=["edit", "add", "remove", "add-and-remove"])
+def test_update_stats_cube_matches_full_build(add, remove):
+    previous = compacted_dataset(BASE)
+    dataset = compacted_dataset(corrected(add=add, remove=remove))
+    changes = diff_datasets(previous, row_fingerprints(previous), dataset, row_fingerprints(dataset))
+    updated = update_stats_cube(build_stats_cube(previous), dataset, changes['services'])
+    assert_cubes_equal(updated, build_stats_cube(dataset))
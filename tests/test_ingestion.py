@@ -0,0 +1,91 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import attendance
+from attendance import DatasetLoads, IngestionCache, JobCancelled, LRUCache, SessionDataManager, load_dataset, process_workbooks
+from tests.conftest import attendance_rows, workbook_bytes
+
+
+@pytest.fixture
+def workbooks():
+    return [("north", workbook_bytes(attendance_rows(60, seed=1))), ("south", workbook_bytes(attendance_rows(40, seed=2)))]
+
+# Function to keep the stats an upload reports, without the timings that change between runs
+def reported(read_stats):
+    return [(stats['source'], stats['rows'], stats['coerced_time_cells']) for stats in read_stats]
+
+
+def test_cache_hits_report_the_read_stats(tmp_path, workbooks):
+    cache = IngestionCache(str(tmp_path), 8, 1 << 30, "test")
+    *_, first = process_workbooks(workbooks, cache)
+    assert [stats['cached'] for stats in first] == [False, False]
+    assert sum(stats['coerced_time_cells'] for stats in first) > 0  # The generated rows hold unreadable times
+    
+    *_, from_memory = process_workbooks(workbooks, cache)
+    assert [stats['cached'] for stats in from_memory] == [True, True]
+    assert reported(from_memory) == reported(first)
+    
+    *_, from_disk = process_workbooks(workbooks, IngestionCache(str(tmp_path), 8, 1 << 30, "test"))
+    assert [stats['cached'] for stats in from_disk] == [True, True]
+    assert reported(from_disk) == reported(first)
+
+def test_read_stats_follow_the_upload_order(tmp_path, workbooks):
+    cache = IngestionCache(str(tmp_path), 8, 1 << 30, "test")
+    process_workbooks(workbooks[1:], cache)
+    *_, read_stats = process_workbooks(workbooks, cache)
+    assert [(stats['source'], stats['cached']) for stats in read_stats] == [("north", False), ("south", True)]
+
+@pytest.fixture
+def session_data(tmp_path):
+    manager = SessionDataManager(str(tmp_path / "sessions"), 3600, 1 << 30)
+    yield manager
+    manager.close()
+
+# Function to replace process_dataset with one that holds its first run until the second load waits for it
+# The first run is cancelled when cancel_first is set
+def hold_first_run(monkeypatch, cancel_first=False):
+    runs = []
+    waiting = threading.Event()
+    process_dataset = attendance.process_dataset
+    
+    def held(*args):
+        runs.append(threading.current_thread().name)
+        if len(runs) == 1:
+            assert waiting.wait(5)
+            if cancel_first:
+                raise JobCancelled()
+        return process_dataset(*args)
+    
+    monkeypatch.setattr(attendance, "process_dataset", held)
+    return runs, waiting
+
+# Function to load the same workbooks from two threads, the second one starting once the first one processes them
+def load_twice(workbooks, session_data, waiting, runs):
+    cache, loads = LRUCache(1 << 30, sizeof=lambda shared: shared.nbytes), DatasetLoads()
+    
+    def first():
+        return load_dataset(workbooks, cache, session_data, loads=loads)
+    
+    def second():
+        while not runs:
+            threading.Event().wait(0.01)
+        return load_dataset(workbooks, cache, session_data, loads=loads, progress=lambda *args: waiting.set())
+    
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(first), executor.submit(second)]
+        return [future.exception() or future.result() for future in futures]
+
+def test_a_second_load_waits_for_the_first(monkeypatch, session_data, workbooks):
+    runs, waiting = hold_first_run(monkeypatch)
+    first, second = load_twice(workbooks, session_data, waiting, runs)
+    assert len(runs) == 1
+    assert second is first
+
+def test_a_waiting_load_takes_over_a_cancelled_one(monkeypatch, session_data, workbooks):
+    runs, waiting = hold_first_run(monkeypatch, cancel_first=True)
+    first, second = load_twice(workbooks, session_data, waiting, runs)
+    assert isinstance(first, JobCancelled)
+    assert len(runs) == 2
+    assert len(second.handle.frame()) == 100
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from attendance import compute_presence
+
+
+# Reference: the row loop compute_presence replaced, reading columns D, H and L by position
+def presence_loop(df):
+    presence = pd.Series(0.0, index=df.index)
+    for idx, row in df.iterrows():
+        jours_presence = row.iloc[11] if len(df.columns) > 11 else None
+        if pd.isna(jours_presence) or jours_presence == '':
+            # Hourly worker: Apply formula D - ((H * 8) + 14)
+            heures_normales = float(row.iloc[3]) if pd.notna(row.iloc[3]) else 0.0
+            conge_annuel = float(row.iloc[7]) if pd.notna(row.iloc[7]) else 0.0
+            presence[idx] = heures_normales - ((conge_annuel * 8) + 14)
+        else:
+            # Daily worker: Use Jours de Présences directly
+            presence[idx] = float(jours_presence) if pd.notna(jours_presence) else 0.0
+    return presence
+
+# Function to build a frame laid out like the export, with the named columns at D, H and L
+def attendance_frame(heures, conge, jours=None, width=15):
+    columns = {f"Col {i}": [f"x{i}"] * len(heures) for i in range(width)}
+    columns["Col 3"] = heures
+    columns["Col 7"] = conge
+    if jours is not None:
+        columns["Col 11"] = jours
+    df = pd.DataFrame(columns)
+    names = {"Col 3": "Heures Normales", "Col 7": "Congé annuel 24/5-23/6", "Col 11": "Jours de Présences 24/5-23/6"}
+    return df.rename(columns={col: name for col, name in names.items() if col in df.columns})
+
+
+HEURES = [192.0, 150.5, np.nan, 0.0, 176.0, 160.0, 8.0]
+CONGE = [0.0, 2.0, 1.0, np.nan, 0.0, 3.0, 0.0]
+
+
+@pytest.mark.parametrize("jours", [
+    [np.nan] * 7,
+    [''] * 7,
+    [np.nan, 22.0, np.nan, 20.0, 0.0, np.nan, 26.0],
+    [np.nan, '', '22', 21.5, '', '19', np.nan],
+    ['22', '21', '20', '19', '18', '17', '16'],
+], ids=["nan", "empty-string", "numeric", "mixed", "string"])
+def test_compute_presence_matches_loop(jours):
+    df = attendance_frame(HEURES, CONGE, pd.Series(jours))
+    pd.testing.assert_series_equal(compute_presence(df), presence_loop(df))
+
+def test_compute_presence_matches_loop_without_column_l():
+    df = attendance_frame(HEURES, CONGE, width=11)
+    assert len(df.columns) == 11
+    pd.testing.assert_series_equal(compute_presence(df), presence_loop(df))
+
+def test_compute_presence_empty_frame():
+    df = attendance_frame([], [], [])
+    pd.testing.assert_series_equal(compute_presence(df), presence_loop(df))
@@ -0,0 +1,44 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from attendance import LRUCache, ReportJobs
+from tests.conftest import attendance_rows, compacted_dataset
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        yield executor
+
+# Function to occupy the single worker until the returned event is set, so that report jobs stay queued
+def block(executor):
+    release = threading.Event()
+    executor.submit(release.wait)
+    return release
+
+
+def test_sessions_share_one_build(executor):
+    dataset = compacted_dataset(attendance_rows(45))
+    jobs = ReportJobs(executor, LRUCache(1 << 30))
+    job = jobs.start("key", dataset, "csv")
+    assert jobs.start("key", dataset, "csv") is job
+    assert jobs.follow("key", "csv") is job
+    job.future.result()
+    assert ("key", "csv") in jobs.cache
+    assert jobs.follow("key", "csv") is None  # Finished, the report is read from the cache
+
+def test_job_cancelled_when_the_last_follower_leaves(executor):
+    dataset = compacted_dataset(attendance_rows(45))
+    jobs = ReportJobs(executor, LRUCache(1 << 30))
+    release = block(executor)
+    job = jobs.start("key", dataset)
+    assert jobs.follow("key", "xlsx") is job
+    
+    jobs.leave(job)
+    assert not job.future.cancelled()  # Another session still follows it
+    jobs.leave(job)
+    assert job.future.cancelled()
+    assert jobs.follow("key", "xlsx") is None
+    release.set()
@@ -0,0 +1,39 @@
+import io
+import zipfile
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from attendance import create_styled_excel, report_column_widths, write_service_reports
+from tests.conftest import attendance_rows, compacted_dataset
+
+
+def test_styled_report_from_compacted_dataset_with_blank_name():
+    dataset = compacted_dataset(attendance_rows(45, blank_names=[3]))
+    assert dataset['Nom & Prénom'].isna().sum() == 1
+    
+    output = io.BytesIO()
+    create_styled_excel(dataset, output)
+    ws = load_workbook(io.BytesIO(output.getvalue()), read_only=True).worksheets[0]
+    names = [row[1] for row in ws.iter_rows(min_row=6, values_only=True) if row and isinstance(row[0], int)]
+    assert len(names) == len(dataset)
+    assert names[3] is None
+
+def test_service_reports_from_compacted_dataset_with_blank_name():
+    dataset = compacted_dataset(attendance_rows(45, blank_names=[0, 7]))
+    output = io.BytesIO()
+    write_service_reports(dataset, output)
+    with zipfile.ZipFile(io.BytesIO(output.getvalue())) as archive:
+        assert len(archive.namelist()) == dataset['Service en cours'].nunique()
+
+def test_column_widths_ignore_empty_cells():
+    df = pd.DataFrame({header: [''] for header in
+                       ["Matr", "Nom & Prénom", "Présence", "H Supp 75%", "Congé", "Congé spécial", "Feries",
+                        "Chom Tech", "Prime de Rendement", "Avance sur salaire", "Prêt /Salaire", "Observations"]})
+    df['Nom & Prénom'] = pd.Series([pd.NA], dtype=pd.StringDtype("pyarrow"))
+    df['Présence'] = [0.0]
+    df['Matr'] = [123456789012]
+    widths = report_column_widths(df)
+    assert widths[0] == len("123456789012") + 2
+    assert widths[1] == len("Nom & Prénom") + 2
+    assert widths[2] == len("Présence") + 2
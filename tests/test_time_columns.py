@@ -0,0 +1,80 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas import Timedelta
+
+from attendance import clean_time_column
+
+
+# Reference: the per-cell function clean_time_column replaced, split so that unreadable values raise
+def read_time(value):
+    if isinstance(value, Timedelta):
+        return value.total_seconds() / 3600.0
+    elif isinstance(value, str) and ":" in value:
+        return float(value.replace(":", "."))
+    elif pd.isna(value):
+        return 0.0
+    else:
+        return float(value)
+
+def clean_time_format(value):
+    try:
+        return read_time(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+# Function to get what clean_time_column should return for some values, from the reference
+# Unlike the reference, datetime.timedelta values are read as hours, 'nan' text is 0.0 (the reference gave NaN,
+# which the Presence formula read as 0) and empty text is a blank cell, not an unreadable value
+def expected(values):
+    cleaned, coerced = [], 0
+    for value in values:
+        if isinstance(value, datetime.timedelta):
+            value = Timedelta(value)
+        try:
+            read_time(value)
+        except (ValueError, TypeError):
+            coerced += value != ''
+        result = clean_time_format(value)
+        cleaned.append(0.0 if np.isnan(result) else result)
+    return pd.Series(cleaned, dtype=float), coerced
+
+COLUMNS = {
+    'timedeltas': [Timedelta(hours=7, minutes=30), Timedelta(0), None, Timedelta(hours=176)],
+    'datetime timedeltas': [datetime.timedelta(hours=8), datetime.timedelta(minutes=90), None],
+    'pandas and datetime timedeltas': [Timedelta(hours=2), datetime.timedelta(hours=1), None],
+    'hours and minutes': ["8:30", "176:00", "0:45", None, ""],
+    'numbers': [8.5, 176, None, 0],
+    'number text': ["8.5", " 7 ", "1e3", "-3", "inf"],
+    'nan text': ["nan", "NaN", "8:00"],
+    'underscores': ["1_000", "8:30", "abc"],
+    'unreadable text': ["abc", "8h30", "8:30:00", "", None],
+    'blanks': [None, np.nan, None],
+    'mixed': [Timedelta(hours=3), datetime.timedelta(hours=1), "8:30", "1_000", "nan", "abc", "", 5, 2.5, True, None,
+              datetime.time(8, 30)],
+}
+
+
+@pytest.mark.parametrize("values", COLUMNS.values(), ids=COLUMNS.keys())
+def test_matches_the_per_cell_function(values):
+    cleaned, coerced = clean_time_column(pd.Series(values, dtype=object))
+    reference, reference_coerced = expected(values)
+    pd.testing.assert_series_equal(cleaned.reset_index(drop=True), reference)
+    assert coerced == reference_coerced
+
+@pytest.mark.parametrize("values", [COLUMNS['hours and minutes'], COLUMNS['underscores'], COLUMNS['mixed']],
+                         ids=['hours and minutes', 'underscores', 'mixed'])
+def test_typed_columns_match_object_columns(values):
+    # Excel reads text columns as strings, not Python objects
+    text = [value for value in values if isinstance(value, str) or value is None]
+    as_objects = clean_time_column(pd.Series(text, dtype=object))
+    as_strings = clean_time_column(pd.Series(text, dtype="str"))
+    pd.testing.assert_series_equal(as_strings[0], as_objects[0])
+    assert as_strings[1] == as_objects[1]
+
+def test_coerced_count():
+    cleaned, coerced = clean_time_column(pd.Series(["8:30", "abc", "", None, "1_000", "nan", "8h30"], dtype=object))
+    assert cleaned.tolist() == [8.3, 0.0, 0.0, 0.0, 1000.0, 0.0, 0.0]
+    assert coerced == 2  # 'abc' and '8h30'; blanks, '1_000' and 'nan' are read